@@ -1,7 +1,15 @@
 """ Entrypoint to amcrest2mqtt package. """
 
-from .amcrest2mqtt import Amcrest2MQTT
-
 __version__ = "2.1.0"
 
 __all__ = ["__version__", "Amcrest2MQTT"]
+
+
+def __getattr__(name: str):
+    # Imported on first use, so processes that don't run a camera (e.g. the supervisor) don't
+    # load the camera and MQTT libraries
+    if name == "Amcrest2MQTT":
+        from .amcrest2mqtt import Amcrest2MQTT
+
+        return Amcrest2MQTT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,7 @@
 import argparse, logging, os
 
-from .amcrest2mqtt import Amcrest2MQTT
 from .const import *
+from .util import str2bool
 
 
 class CustomArgumentParser(argparse.ArgumentParser):
@@ -16,16 +16,20 @@ class CustomArgumentParser(argparse.ArgumentParser):
 def main():
     parser = CustomArgumentParser()
     parser.add_argument("--device-name", metavar="S", type=str)
-    parser.add_argument("--amcrest-host", metavar="S", required=True, type=str)
+    parser.add_argument(
+        "--amcrest-host", metavar="S", help="Required unless --cameras-file is used", type=str
+    )
     parser.add_argument("--amcrest-port", metavar="N", default=DEFAULT_AMCREST_PORT, type=int)
     parser.add_argument(
         "--amcrest-username", metavar="S", default=DEFAULT_AMCREST_USERNAME, type=str
     )
-    parser.add_argument("--amcrest-password", metavar="S", required=True, type=str)
+    parser.add_argument(
+        "--amcrest-password", metavar="S", help="Required unless --cameras-file is used", type=str
+    )
     parser.add_argument(
         "--storage-poll-interval",
         metavar="N",
-        help="Number of seconds between checks for storage sensors/entities; 0 to disable",
+        help="Number of seconds between checks for storage and health sensors/entities; 0 to disable",
         default=DEFAULT_STORAGE_POLL_INTERVAL,
         type=int,
     )
@@ -57,6 +61,20 @@ def main():
         type=float,
         default=DEFAULT_DOORBELL_OFF_TIMEOUT,
     )
+    parser.add_argument(
+        "--mqtt-protocol",
+        metavar="VERSION",
+        help="The MQTT protocol version; with 5, frequently published topics are sent as topic aliases, and events expire after --mqtt-event-expiry. Falls back to 3.1.1 if the broker doesn't support 5",
+        default=DEFAULT_MQTT_PROTOCOL,
+        choices=[MQTT_PROTOCOL_V311, MQTT_PROTOCOL_V5],
+    )
+    parser.add_argument(
+        "--mqtt-event-expiry",
+        metavar="N",
+        help="With MQTT v5, number of seconds the broker retains events for; 0 to retain them indefinitely",
+        default=DEFAULT_MQTT_EVENT_EXPIRY,
+        type=int,
+    )
     parser.add_argument(
         "--home-assistant-prefix",
         metavar="S",
@@ -64,17 +82,194 @@ def main():
         default=DEFAULT_HOME_ASSISTANT_PREFIX,
         type=str,
     )
+    parser.add_argument(
+        "--high-availability",
+        metavar="BOOL",
+        help="Run as one of several instances serving the same device, only the elected leader publishing; requires --mqtt-client-suffix",
+        default=DEFAULT_HIGH_AVAILABILITY,
+        type=str2bool,
+    )
+    parser.add_argument(
+        "--ha-lease-ttl",
+        metavar="N",
+        help="Number of seconds without a heartbeat from the leader before a standby instance takes over",
+        default=DEFAULT_HA_LEASE_TTL,
+        type=float,
+    )
+    parser.add_argument(
+        "--cameras-file",
+        metavar="PATH",
+        help="A JSON list of cameras to run across worker processes, each an object of settings (e.g. amcrest_host, amcrest_password, serial_no) overriding the other arguments",
+        type=str,
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="N",
+        help="Number of worker processes to run the cameras of --cameras-file across; 0 for one per CPU core",
+        default=DEFAULT_WORKERS,
+        type=int,
+    )
+    parser.add_argument(
+        "--entity-registry",
+        metavar="PATH",
+        help="A JSON (or YAML) file of entity definitions to use instead of the built-in ones",
+        type=str,
+    )
+    parser.add_argument(
+        "--snapshots",
+        metavar="BOOL",
+        help="Publish a camera snapshot when the doorbell is pressed or a human is detected",
+        default=DEFAULT_SNAPSHOTS,
+        type=str2bool,
+    )
+    parser.add_argument(
+        "--snapshot-min-interval",
+        metavar="N",
+        help="Minimum number of seconds between published snapshots",
+        default=DEFAULT_SNAPSHOT_MIN_INTERVAL,
+        type=float,
+    )
+    parser.add_argument(
+        "--snapshot-max-width",
+        metavar="N",
+        help="Downscale snapshots wider than this many pixels (requires Pillow); 0 to disable",
+        default=DEFAULT_SNAPSHOT_MAX_WIDTH,
+        type=int,
+    )
+    parser.add_argument(
+        "--snapshot-prebuffer-size",
+        metavar="N",
+        help="Number of recent snapshots to keep in memory while motion is active, so one can be published the instant the doorbell is pressed or a human is detected (minimum 2, each takes 1 MiB); 0 to disable",
+        default=DEFAULT_SNAPSHOT_PREBUFFER_SIZE,
+        type=int,
+    )
+    parser.add_argument(
+        "--snapshot-prebuffer-interval",
+        metavar="N",
+        help="Number of seconds between snapshots kept in memory while motion is active",
+        default=DEFAULT_SNAPSHOT_PREBUFFER_INTERVAL,
+        type=float,
+    )
+    parser.add_argument(
+        "--event-encoding",
+        metavar="FORMAT",
+        help="The encoding of events published to the event topic: json, msgpack (requires msgpack) or cbor (requires cbor2)",
+        default=DEFAULT_EVENT_ENCODING,
+        choices=[EVENT_ENCODING_JSON, EVENT_ENCODING_MSGPACK, EVENT_ENCODING_CBOR],
+    )
+    parser.add_argument(
+        "--event-batch-window",
+        metavar="N",
+        help="Publish events to the event topic in batches, as a list of the events received within this many seconds; 0 to publish each event on its own",
+        default=DEFAULT_EVENT_BATCH_WINDOW,
+        type=float,
+    )
+    parser.add_argument(
+        "--event-batch-compression",
+        metavar="BOOL",
+        help="Compress batches of events with zlib",
+        default=DEFAULT_EVENT_BATCH_COMPRESSION,
+        type=str2bool,
+    )
+    parser.add_argument(
+        "--rollups",
+        metavar="BOOL",
+        help="Publish event counts and durations (e.g. seconds of motion, doorbell presses) every minute and every hour",
+        default=DEFAULT_ROLLUPS,
+        type=str2bool,
+    )
+    parser.add_argument(
+        "--latency-metrics",
+        metavar="BOOL",
+        help="Track the time from receiving an event to the broker acknowledging the resulting states, published as p50/p95/p99 diagnostic sensors",
+        default=DEFAULT_LATENCY_METRICS,
+        type=str2bool,
+    )
+    parser.add_argument(
+        "--latency-slo",
+        metavar="N",
+        help="With --latency-metrics, warn when the p95 latency exceeds this many milliseconds; 0 to disable",
+        default=DEFAULT_LATENCY_SLO,
+        type=float,
+    )
+    parser.add_argument(
+        "--diagnostics-dir",
+        metavar="PATH",
+        help="Enable profiling and tracing on demand (through the diagnostics MQTT topic, SIGUSR1 or SIGUSR2), writing results to this directory",
+        type=str,
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Append every event received from the camera to a compressed recording, for --replay",
+        type=str,
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="Replay the events of a recording instead of connecting to a camera",
+        type=str,
+    )
+    parser.add_argument(
+        "--replay-speed",
+        metavar="N",
+        help="Speed to replay events at, relative to the pace they were recorded at; 0 for as fast as possible",
+        default=DEFAULT_REPLAY_SPEED,
+        type=float,
+    )
+    parser.add_argument(
+        "--log-level",
+        metavar="LEVEL",
+        help="The logging level, e.g. DEBUG, INFO or WARNING",
+        default=DEFAULT_LOG_LEVEL,
+        type=str.upper,
+    )
+    parser.add_argument(
+        "--config-file",
+        metavar="PATH",
+        help="A JSON object of settings overriding the other arguments (e.g. config_poll_interval); reloaded when modified or on SIGHUP",
+        type=str,
+    )
+
+    args = vars(parser.parse_args())
 
     logging.basicConfig(
-        level=logging.INFO,
+        level=args["log_level"],
         datefmt="%d/%m/%Y %H:%M:%S",
         format="%(asctime)s [%(levelname)s] %(message)s",
     )
 
     logging.captureWarnings(True)
+    cameras_file = args.pop("cameras_file")
+    workers = args.pop("workers")
+
+    if cameras_file:
+        if args["config_file"]:
+            parser.error("--config-file can't be combined with --cameras-file")
+
+        from .supervisor import Supervisor
+
+        defaults = {name: value for name, value in args.items() if value is not None}
+        try:
+            supervisor = Supervisor.from_file(cameras_file, workers, defaults, fields=set(args))
+        except (OSError, ValueError) as exc:
+            parser.error(f"--cameras-file: {exc}")
+        supervisor.run()
+        return
+
+    # Only imported once arguments are valid, as it loads the camera and MQTT libraries
+    from .amcrest2mqtt import Amcrest2MQTT
+
+    try:
+        app = Amcrest2MQTT(**args)
+    except (OSError, ValueError) as exc:
+        parser.error(f"--config-file: {exc}")
+
+    # Checked once the config file has been applied, as it may provide these
+    for name in ("amcrest_host", "amcrest_password"):
+        if getattr(app, name) is None and not app.replay:
+            parser.error(f"the following arguments are required: --{name.replace('_', '-')}")
 
-    args = vars(parser.parse_args())
-    app = Amcrest2MQTT(**args)
     app.run()
 
 
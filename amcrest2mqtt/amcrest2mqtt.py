@@ -1,17 +1,36 @@
 import dataclasses
+from datetime import datetime, timezone
+import json
 import logging
+import math
 import os
 import signal
 import sys
-from threading import Thread, Timer
+import time
+from collections import Counter
+from threading import Event, Lock, Thread, Timer, current_thread, main_thread
 import typing as t
 
 from .camera import Camera, AmcrestError
 from .const import *
-from .entity import Entity
+from .diagnostics import SamplingProfiler, StageTracer, write_folded
+from .encoding import EventBatcher, EventEncoder
 from .mqtt_client import MQTTClient, MQTTMessage
+from .registry import EntityRegistry
 from .util import clamp, ping, str2bool
 
+# Optional subsystems are imported when enabled, keeping startup time and memory down otherwise
+if t.TYPE_CHECKING:
+    from .commands import CommandPipeline
+    from .device import Device
+    from .discovery import DiscoveryManager
+    from .health import Health, HealthPoller
+    from .latency import LatencyTracker
+    from .leader import LeaderElection
+    from .recorder import EventRecorder
+    from .rollup import EventAggregator
+    from .snapshot import SnapshotPipeline
+
 
 _is_exiting = False  # Global
 
@@ -19,6 +38,26 @@ _is_exiting = False  # Global
 logger = logging.getLogger(__name__)
 
 
+# Fields applied in place when the config file is reloaded; any other change needs a restart
+RELOADABLE_FIELDS = frozenset(
+    {
+        "amcrest_username",
+        "amcrest_password",
+        "storage_poll_interval",
+        "config_poll_interval",
+        "doorbell_off_timeout",
+        "log_level",
+        "snapshot_min_interval",
+    }
+)
+
+# Accepted values of fields, as checked by the command line parser
+FIELD_CHOICES = {
+    "event_encoding": (EVENT_ENCODING_JSON, EVENT_ENCODING_MSGPACK, EVENT_ENCODING_CBOR),
+    "mqtt_protocol": (MQTT_PROTOCOL_V311, MQTT_PROTOCOL_V5),
+}
+
+
 @dataclasses.dataclass(init=True, repr=False, eq=False, order=False)
 class Amcrest2MQTT:
     amcrest_host: str = MISSING
@@ -37,10 +76,36 @@ class Amcrest2MQTT:
     mqtt_tls_ca_cert: t.Optional[str] = None
     mqtt_tls_cert: t.Optional[str] = None
     mqtt_tls_key: t.Optional[str] = None
+    mqtt_protocol: str = DEFAULT_MQTT_PROTOCOL
+    mqtt_event_expiry: int = DEFAULT_MQTT_EVENT_EXPIRY
     home_assistant_prefix: t.Optional[str] = DEFAULT_HOME_ASSISTANT_PREFIX
+    high_availability: bool = DEFAULT_HIGH_AVAILABILITY
+    ha_lease_ttl: float = DEFAULT_HA_LEASE_TTL
     doorbell_off_timeout: float = DEFAULT_DOORBELL_OFF_TIMEOUT
+    entity_registry: t.Optional[str] = None
+    snapshots: bool = DEFAULT_SNAPSHOTS
+    snapshot_min_interval: float = DEFAULT_SNAPSHOT_MIN_INTERVAL
+    snapshot_max_width: int = DEFAULT_SNAPSHOT_MAX_WIDTH
+    snapshot_prebuffer_size: int = DEFAULT_SNAPSHOT_PREBUFFER_SIZE
+    snapshot_prebuffer_interval: float = DEFAULT_SNAPSHOT_PREBUFFER_INTERVAL
+    log_level: str = DEFAULT_LOG_LEVEL
+    config_file: t.Optional[str] = None
+    event_encoding: str = DEFAULT_EVENT_ENCODING
+    event_batch_window: float = DEFAULT_EVENT_BATCH_WINDOW
+    event_batch_compression: bool = DEFAULT_EVENT_BATCH_COMPRESSION
+    rollups: bool = DEFAULT_ROLLUPS
+    latency_metrics: bool = DEFAULT_LATENCY_METRICS
+    latency_slo: float = DEFAULT_LATENCY_SLO
+    diagnostics_dir: t.Optional[str] = None
+    record: t.Optional[str] = None
+    replay: t.Optional[str] = None
+    replay_speed: float = DEFAULT_REPLAY_SPEED
 
     def __post_init__(self):
+        if self.config_file:
+            for name, value in self.read_config_file().items():
+                setattr(self, name, value)
+
         if self.amcrest_host is MISSING:
             raise TypeError(f"{type(self).__qualname__}() requires str argument 'amcrest_host'")
         if self.amcrest_password is MISSING:
@@ -48,22 +113,76 @@ class Amcrest2MQTT:
         if self.mqtt_username is MISSING:
             raise TypeError(f"{type(self).__qualname__}() requires str argument 'mqtt_username'")
 
+        if self.high_availability and not self.mqtt_client_suffix:
+            raise ValueError(
+                f"{type(self).__qualname__}() requires 'mqtt_client_suffix' "
+                "with 'high_availability'"
+            )
+
+        if self.replay:
+            # There's no camera to poll or take snapshots from
+            self.storage_poll_interval = 0
+            self.config_poll_interval = 0
+            self.snapshots = False
+
+        # Reported to the supervisor when running as one of several cameras in a worker process
+        self.metrics: t.Counter[str] = Counter()
+        # Whether exiting the app exits the process; a worker process instead restarts the camera
+        self.exit_process = True
+        self.stopped = Event()
+        self._run_thread: t.Optional[Thread] = None
+        # Set by `run()`, but the app may be stopped before getting that far
+        self.device: t.Optional[Device] = None
+        self.mqtt_client: t.Optional[MQTTClient] = None
+        self.snapshot_pipeline: t.Optional[SnapshotPipeline] = None
+        # Only set with high availability, see `is_active`
+        self.leader: t.Optional[LeaderElection] = None
+        # Pending poller runs, by name
+        self._poll_timers: t.Dict[str, Timer] = {}
+        self._poll_timers_lock = Lock()
+        self._reload_lock = Lock()
+        self.recorder: t.Optional[EventRecorder] = None
+        self.event_batcher: t.Optional[EventBatcher] = None
+        self.aggregator: t.Optional[EventAggregator] = None
+        self.tracer = StageTracer()
+        self.profiler = SamplingProfiler()
+        self.latency: t.Optional[LatencyTracker] = None
+        # Round-trip time of commands, from receiving them to the camera confirming them
+        self.command_rtt: t.Optional[LatencyTracker] = None
+        self._latency_slo_breached: t.Optional[bool] = None
+
     def run(self):
         from amcrest2mqtt import __version__
 
         logger.info(f"{APP_NAME} v{__version__}")
+        self._run_thread = current_thread()
 
-        # Handle interruptions
-        signal.signal(signal.SIGINT, self.signal_handler)
+        # Handle interruptions (signal handlers can only be set from the main thread, e.g. not when
+        # running as one of several cameras in a supervisor's worker process)
+        if current_thread() is main_thread():
+            signal.signal(signal.SIGINT, self.signal_handler)
+            if hasattr(signal, "SIGHUP"):  # Not on Windows
+                signal.signal(signal.SIGHUP, self.reload_signal_handler)
+                if self.diagnostics_dir:
+                    signal.signal(signal.SIGUSR1, self.diagnostics_signal_handler)
+                    signal.signal(signal.SIGUSR2, self.diagnostics_signal_handler)
+
+        logging.getLogger().setLevel(self.log_level)
 
         try:
-            self.camera = Camera(
-                host=self.amcrest_host,
-                port=self.amcrest_port,
-                username=self.amcrest_username,
-                password=self.amcrest_password,
-                device_name=self.device_name,
-            )
+            if self.replay:
+                from .recorder import ReplayCamera
+
+                logger.info(f'Replaying events from "{self.replay}"')
+                self.camera = ReplayCamera(self.replay, self.replay_speed)
+            else:
+                self.camera = Camera(
+                    host=self.amcrest_host,
+                    port=self.amcrest_port,
+                    username=self.amcrest_username,
+                    password=self.amcrest_password,
+                    device_name=self.device_name,
+                )
         except Exception as exc:
             logger.error(f"Could not connect to Amcrest camera device: {exc}")
             sys.exit(1)
@@ -92,6 +211,8 @@ class Amcrest2MQTT:
                 tls_cert=self.mqtt_tls_cert,
                 tls_key=self.mqtt_tls_key,
                 device=self.device,
+                protocol=self.mqtt_protocol,
+                tracer=self.tracer,
             )
             self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
             self.mqtt_client.on_message = self.on_mqtt_message
@@ -100,67 +221,266 @@ class Amcrest2MQTT:
             sys.exit(1)
 
         # Create entities
-        self.entity_doorbell = self.create_entity(**Entity.DEF_DOORBELL)
-        self.entity_human = self.create_entity(**Entity.DEF_HUMAN)
-        self.entity_flashlight = self.create_entity(**Entity.DEF_FLASHLIGHT)
-        self.entity_motion = self.create_entity(**Entity.DEF_MOTION)
-        self.entity_storage_used_percent = self.create_entity(**Entity.DEF_STORAGE_USED_PERCENT)
-        self.entity_storage_used = self.create_entity(**Entity.DEF_STORAGE_USED)
-        self.entity_storage_total = self.create_entity(**Entity.DEF_STORAGE_TOTAL)
-        self.entity_siren_volume = self.create_entity(**Entity.DEF_SIREN_VOLUME)
-        self.entity_watermark = self.create_entity(**Entity.DEF_WATERMARK)
-        self.entity_indicator_light = self.create_entity(**Entity.DEF_INDICATOR_LIGHT)
+        features = set()
+        if self.storage_poll_interval > 0:
+            features.add(FEATURE_HEALTH)
+        if self.snapshots:
+            features.add(FEATURE_SNAPSHOTS)
+        if self.latency_metrics:
+            from .latency import LatencyTracker
+
+            self.latency = LatencyTracker()
+            self.command_rtt = LatencyTracker()
+            features.add(FEATURE_LATENCY)
+        if self.latency_metrics and self.latency_slo > 0:
+            features.add(FEATURE_LATENCY_SLO)
+
+        try:
+            registry = EntityRegistry.load(self.entity_registry)
+        except (OSError, ValueError, TypeError, KeyError) as exc:
+            logger.error(f"Could not load entity registry: {exc}")
+            sys.exit(1)
+
+        self.entities = registry.compile(self.device, features)
+
+        try:
+            self.event_encoder = EventEncoder(
+                self.event_encoding,
+                compress=self.event_batch_compression and self.event_batch_window > 0,
+            )
+        except (ImportError, ValueError) as exc:
+            logger.error(f'Could not use event encoding "{self.event_encoding}": {exc}')
+            sys.exit(1)
+        if self.event_batch_window > 0:
+            self.event_batcher = EventBatcher(self.event_batch_window, self.publish_event_batch)
+
+        # Published on every event, so worth sending as MQTT v5 topic aliases
+        self.mqtt_client.register_topic_alias(self.device.event_topic)
+        for name_slug in ("motion", "human", "doorbell", "flashlight"):
+            entity = self.entities.get(name_slug)
+            if entity is not None:
+                self.mqtt_client.register_topic_alias(entity.base_topic)
 
         self.doorbell_off_timer: t.Optional[Timer] = None
 
+        self.health_poller: t.Optional[HealthPoller] = None
+        health: t.Optional[Health] = None
+        if self.storage_poll_interval > 0:
+            from .health import Health, HealthPoller
+
+            self.health_poller = HealthPoller(
+                self.camera,
+                {
+                    field: self.entities.get(field)
+                    for field in Health._fields
+                    if field in self.entities
+                },
+            )
+            # Fetched before discovery so entities of queries the camera doesn't support aren't
+            # created
+            logger.info("Performing initial fetch of health sensors...")
+            health = self.health_poller.fetch()
+
         # Configure Home Assistant
+        self.discovery: t.Optional[DiscoveryManager] = None
+        # Commands are only subscribed to through Home Assistant discovery
+        self.command_pipeline: t.Optional[CommandPipeline] = None
         if self.home_assistant_prefix:
-            logger.info("Writing Home Assistant discovery config...")
+            from .commands import CommandPipeline
+            from .discovery import DiscoveryManager
+
+            entities = list(self.entities)
+            if self.health_poller is not None:
+                health_entities = set(self.health_poller.entities.values())
+                entities = [entity for entity in entities if entity not in health_entities]
+                entities += self.health_poller.supported_entities()
+
+            self.discovery = DiscoveryManager(self, entities)
+            self.command_pipeline = CommandPipeline(
+                self.camera, self.entities, self.metrics, rtt=self.command_rtt
+            )
+
+        self.snapshot_pipeline: t.Optional[SnapshotPipeline] = None
+        if self.snapshots and "snapshot" not in self.entities:
+            logger.warning('Snapshots require a "snapshot" entity, which the registry lacks')
+        elif self.snapshots:
+            from .snapshot import SnapshotPipeline, SnapshotRingBuffer
+
+            # Snapshots get their own connection so they never queue behind the event stream
+            snapshot_camera = Camera(
+                host=self.amcrest_host,
+                port=self.amcrest_port,
+                username=self.amcrest_username,
+                password=self.amcrest_password,
+                device_name=self.device_name,
+            )
+            prebuffer = None
+            if self.snapshot_prebuffer_size > 0:
+                prebuffer = SnapshotRingBuffer(
+                    snapshot_camera,
+                    size=self.snapshot_prebuffer_size,
+                    interval=self.snapshot_prebuffer_interval,
+                )
+            self.snapshot_pipeline = SnapshotPipeline(
+                snapshot_camera,
+                self.entities.get("snapshot"),
+                min_interval=self.snapshot_min_interval,
+                max_width=self.snapshot_max_width,
+                prebuffer=prebuffer,
+            )
+            self.snapshot_pipeline.start()
+
+        # Begin main behavior
+        if self.high_availability:
+            from .leader import LeaderElection
+
+            # Everything above is kept warm on standby, so taking over only needs to publish
+            logger.info("Starting leader election...")
+            self.leader = LeaderElection(
+                self.mqtt_client,
+                self.device.leader_topic,
+                self.mqtt_client.client_id,
+                ttl=self.ha_lease_ttl,
+                on_elected=self.activate,
+                on_demoted=self.deactivate,
+            )
+            if self.discovery is not None:
+                self.discovery.watch()
+            self.mqtt_client.message_callback_add(
+                self.device.status_topic, self.on_mqtt_status_message
+            )
+            self.mqtt_client.subscribe(self.device.status_topic, qos=self.mqtt_qos)
+            self.leader.start()
+        else:
+            self.activate(health)
+
+        self.schedule_poll("config", self.config_poll_interval, self.refresh_config_sensors)
+        self.schedule_poll("health", self.storage_poll_interval, self.refresh_health_sensors)
+        if self.latency_metrics:
+            self.schedule_poll("latency", LATENCY_PUBLISH_INTERVAL, self.refresh_latency_sensors)
+        if self.rollups:
+            from .rollup import EventAggregator
 
-            if self.is_doorbell:
-                self.entity_doorbell.setup_ha(self)
+            self.aggregator = EventAggregator(
+                ROLLUP_WINDOWS, tallies=["doorbell_presses"], states=["motion", "human"]
+            )
+            for window in ROLLUP_WINDOWS:
+                self.schedule_rollup(window)
+
+        if not self.replay:
+            logger.info("Performing initial camera ping...")
+            self.ping_camera()
+
+        if self.record:
+            from .recorder import EventRecorder
+
+            logger.info(f'Recording events to "{self.record}"')
+            self.recorder = EventRecorder(self.record, self.device)
+
+        if self.diagnostics_dir:
+            topic = f"{self.device.diagnostics_topic}/set"
+            logger.info(f'Subscribing to diagnostics command topic "{topic}"')
+            self.mqtt_client.message_callback_add(topic, self.on_mqtt_diagnostics_message)
+            self.mqtt_client.subscribe(topic, qos=self.mqtt_qos)
+
+        if self.config_file:
+            Thread(target=self.watch_config_file, name="config-file-watch", daemon=True).start()
+
+        while True:
+            if self.leader is not None:
+                self.leader.wait_elected()
+
+            logger.info("Entering infinite loop; listening for events...")
+
+            events = self.camera.events()
+            try:
+                for code, payload in self.traced_events(events):
+                    if self.stopped.is_set():
+                        return
+                    received_at = time.monotonic()
+                    if self.recorder is not None:
+                        self.recorder.record(code, payload)
+                    if not self.is_active:
+                        break
+                    with self.tracer.stage("dispatch"):
+                        self.handle_event(code, payload, received_at)
+                else:
+                    break
+            except AmcrestError as error:
+                logger.error(f"Amcrest error {error}")
+                self.exit_gracefully(1)
+            finally:
+                events.close()
+
+        if self.replay:
+            logger.info("Replay finished")
+            self.exit_gracefully(0)
+
+    def traced_events(self, events: t.Iterator[t.Tuple[str, dict]]):
+        """
+        Yield from `events`, timing the wait for each one as its own stage when tracing
+
+        The camera library reads and parses events as they arrive, so that time can't be told
+        apart from the wait; it is left out of the stages of handling events.
+        """
+        while True:
+            with self.tracer.stage("wait"):
+                event = next(events, None)
+            if event is None:
+                return
+            yield event
 
-            if self.is_ad410:
-                self.entity_human.setup_ha(self)
-                self.entity_flashlight.setup_ha(self)
-                self.entity_siren_volume.setup_ha(self)
-                self.entity_watermark.setup_ha(self)
-                self.entity_indicator_light.setup_ha(self)
+    @property
+    def is_active(self) -> bool:
+        """Whether this instance serves the device, i.e. isn't on standby"""
+        return self.leader is None or self.leader.is_leader
 
-            self.entity_motion.setup_ha(self)
+    def activate(self, health: t.Optional["Health"] = None):
+        """
+        Start serving the device: publish discovery and availability, subscribe to command
+        topics and publish the initial state of entities
 
-            if self.storage_poll_interval > 0:
-                self.entity_storage_used_percent.setup_ha(self)
-                self.entity_storage_used.setup_ha(self)
-                self.entity_storage_total.setup_ha(self)
+        Called once on startup, or whenever this instance is elected leader
+        """
+        from amcrest2mqtt import __version__
+
+        if self.discovery is not None:
+            logger.info("Writing Home Assistant discovery config...")
+            self.discovery.publish()
 
-        # Begin main behavior
         self.mqtt_publish(self.device.status_topic, PAYLOAD_ONLINE)
 
         # Not used by Home Assistant -- for purely MQTT-based uses
         self.mqtt_publish(
             self.device.config_topic,
-            {"version": __version__, **self.device.as_mqtt_device_dict()},
+            {
+                "version": __version__,
+                **self.device.as_mqtt_device_dict(),
+                "event_encoding": {
+                    **self.event_encoder.as_dict(),
+                    "batch_window": self.event_batch_window,
+                },
+            },
             json=True,
         )
 
         if self.config_poll_interval > 0:
-            self.refresh_config_sensors(initial=True)
+            logger.info("Performing initial fetch of config sensors...")
+            self.refresh_config_state()
 
         if self.storage_poll_interval > 0:
-            self.refresh_storage_sensors(initial=True)
-
-        logger.info("Performing initial camera ping...")
-        self.ping_camera()
-
-        logger.info("Entering infinite loop; listening for events...")
-
-        try:
-            for code, payload in self.camera.events():
-                self.handle_event(code, payload)
-        except AmcrestError as error:
-            logger.error(f"Amcrest error {error}")
-            self.exit_gracefully(1)
+            # On election, a standby has fetched health already
+            health = health or self.health_poller.latest
+            if health is None:
+                logger.info("Performing initial fetch of health sensors...")
+                health = self.health_poller.fetch()
+            # Another instance may have published different values while this one was on standby
+            self.health_poller.publish(health, force=True)
+
+    def deactivate(self):
+        """Stop serving the device when another instance takes over"""
+        if self.discovery is not None:
+            self.discovery.unsubscribe()
 
     @property
     def is_ad110(self):
@@ -176,31 +496,46 @@ class Amcrest2MQTT:
     def is_doorbell(self):
         return self.is_ad110 or self.is_ad410
 
-    def mqtt_publish(self, topic: str, payload: t.Any, exit_on_error=True, json=False):
+    def mqtt_publish(
+        self, topic: str, payload: t.Any, exit_on_error=True, json=False, wait=True, **kwargs
+    ):
         assert self.mqtt_client is not None
 
         try:
-            return self.mqtt_client.publish(topic, payload, json)
+            msg = self.mqtt_client.publish(topic, payload, json, wait=wait, **kwargs)
+            self.metrics["publishes"] += 1
+            return msg
         except Exception as exc:
+            self.metrics["publish_errors"] += 1
             logger.exception(exc)
             if exit_on_error:
                 self.exit_gracefully(1, skip_mqtt=True)
 
-    def create_entity(
-        self,
-        name: str,
-        component: str,
-        *,
-        friendly_name: str = None,
-        **extra_config,
-    ):
-        return Entity(self.device, name, component, friendly_name=friendly_name, **extra_config)
-
     def on_mqtt_disconnect(self, client, userdata, rc: int):
         if rc != 0:
             logger.error(f"Unexpected MQTT disconnection")
             self.exit_gracefully(rc, skip_mqtt=True)
 
+    def on_mqtt_status_message(self, client, userdata, message: MQTTMessage):
+        # A standby's last will marks the device offline when it dies, correct that
+        if self.is_active and message.payload.decode() == PAYLOAD_OFFLINE:
+            logger.info("Device marked offline by another instance, republishing availability")
+            self.mqtt_client.publish(self.device.status_topic, PAYLOAD_ONLINE, wait=False)
+
+    def on_mqtt_diagnostics_message(self, client, userdata, message: MQTTMessage):
+        # Either "profile" or "trace", or a JSON object, e.g. {"action": "profile", "duration": 10}
+        payload = message.payload.decode().strip()
+        try:
+            command = json.loads(payload) if payload.startswith("{") else {"action": payload}
+            action = command["action"]
+            duration = float(command.get("duration", DEFAULT_DIAGNOSTICS_DURATION))
+            if not math.isfinite(duration):
+                raise ValueError(duration)
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f'Invalid diagnostics command "{payload}"')
+            return
+        self.start_diagnostics(action, duration)
+
     def on_mqtt_message(self, client, userdata, message: MQTTMessage):
         handler_thread = Thread(
             target=self.handle_mqtt_message,
@@ -211,9 +546,47 @@ class Amcrest2MQTT:
 
     def exit_gracefully(self, rc: int, skip_mqtt=False):
         logger.info("Exiting app...")
+        self.stop(skip_mqtt=skip_mqtt)
+
+        if self.exit_process:
+            # Use os._exit instead of sys.exit to ensure an MQTT disconnect event
+            # causes the program to exit correctly as they occur on a separate thread
+            os._exit(rc)
+
+        # Only the camera stops; its worker process notices `stopped` and restarts it
+        if current_thread() is self._run_thread:
+            sys.exit(rc)
+
+    def stop(self, skip_mqtt=False, publish_offline=True):
+        """
+        Stop serving the device, without exiting the process
+
+        With `publish_offline=False`, the device isn't marked offline, e.g. when another worker
+        process takes the camera over
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+
+        with self._poll_timers_lock:
+            for timer in self._poll_timers.values():
+                timer.cancel()
+            self._poll_timers.clear()
+
+        if self.snapshot_pipeline is not None:
+            self.snapshot_pipeline.stop()
+
+        if self.recorder is not None:
+            self.recorder.close()
 
         if self.mqtt_client is not None and self.mqtt_client.is_connected() and not skip_mqtt:
-            if self.device:
+            # A standby must not mark the device offline while the leader is serving it
+            was_active = self.is_active
+            if self.event_batcher is not None:
+                self.event_batcher.flush()
+            if self.leader is not None:
+                self.leader.release()
+            if self.device and was_active and publish_offline:
                 self.mqtt_publish(
                     self.device.status_topic,
                     PAYLOAD_OFFLINE,
@@ -221,22 +594,43 @@ class Amcrest2MQTT:
                 )
             self.mqtt_client.loop_stop(force=True)
             self.mqtt_client.disconnect()
+        elif self.mqtt_client is not None and not self.exit_process:
+            # Otherwise the network loop would keep reconnecting after the camera is restarted
+            if self.leader is not None:
+                self.leader.release()
+            self.mqtt_client.loop_stop(force=True)
+
+    def handle_event(self, code, payload, received_at: t.Optional[float] = None):
+        """
+        Publish the states an event changes, and the event itself
 
-        # Use os._exit instead of sys.exit to ensure an MQTT disconnect event
-        # causes the program to exit correctly as they occur on a separate thread
-        os._exit(rc)
+        `received_at` is when the event was read from the camera (monotonic), to track latency
+        """
+        self.metrics["events"] += 1
+        if self.aggregator is not None:
+            self.aggregator.count(code)
 
-    def handle_event(self, code, payload):
         if code == ("ProfileAlarmTransmit" if self.is_ad110 else "VideoMotion"):
             motion_payload = PAYLOAD_ON if payload["action"] == "Start" else PAYLOAD_OFF
-            self.entity_motion.publish(motion_payload)
+            self.publish_state("motion", motion_payload, received_at=received_at)
+            if self.aggregator is not None:
+                self.aggregator.set_active("motion", motion_payload == PAYLOAD_ON)
+            if self.snapshot_pipeline is not None:
+                self.snapshot_pipeline.set_motion(motion_payload == PAYLOAD_ON)
         elif code == "CrossRegionDetection" and payload["data"]["ObjectType"] == "Human":
             human_payload = PAYLOAD_ON if payload["action"] == "Start" else PAYLOAD_OFF
-            self.entity_human.publish(human_payload)
+            self.publish_state("human", human_payload, received_at=received_at)
+            if self.aggregator is not None:
+                self.aggregator.set_active("human", human_payload == PAYLOAD_ON)
+            if human_payload == PAYLOAD_ON:
+                self.trigger_snapshot("human")
         elif code == "_DoTalkAction_":
             doorbell_payload = PAYLOAD_ON if payload["data"]["Action"] == "Invite" else PAYLOAD_OFF
-            self.entity_doorbell.publish(doorbell_payload)
+            self.publish_state("doorbell", doorbell_payload, received_at=received_at)
             if doorbell_payload == PAYLOAD_ON:
+                self.trigger_snapshot("doorbell")
+                if self.aggregator is not None:
+                    self.aggregator.tally("doorbell_presses")
                 if self.doorbell_off_timeout:
                     self.doorbell_off_timer = Timer(self.doorbell_off_timeout, self._send_doorbell_off).start()
             else:
@@ -247,112 +641,374 @@ class Amcrest2MQTT:
             light_mode = (
                 LIGHT_EFFECT_STROBE if "true" in payload["data"]["Flicker"] else LIGHT_EFFECT_NONE
             )
-            self.entity_flashlight.publish(light_payload)
-            self.entity_flashlight.publish(light_mode, "effect")
+            self.publish_state("flashlight", light_payload, received_at=received_at)
+            self.publish_state("flashlight", light_mode, "effect", received_at=received_at)
+            if self.command_pipeline is not None:
+                self.command_pipeline.confirm(
+                    "flashlight", {"": light_payload, "effect": light_mode}
+                )
 
-        self.mqtt_publish(self.device.event_topic, payload, json=True)
+        if self.event_batcher is not None:
+            self.event_batcher.add(payload)
+        else:
+            self.publish_event(code, payload, received_at)
         logger.info(str(payload))
 
-    def handle_mqtt_message(self, topic: str, payload: str):
-        if self.is_ad410 and topic == self.entity_indicator_light.command_topics["command"]:
-            logger.info(f"Setting Indicator Light to {payload}")
-            self.camera.set_config({CONFIG_INDICATOR_LIGHT: payload == PAYLOAD_ON})
-            self._refresh_config_indicator_light()
-        elif self.is_ad410 and topic == self.entity_watermark.command_topics["command"]:
-            logger.info(f"Setting Watermark to {payload}")
-            self.camera.set_config({CONFIG_WATERMARK: payload == PAYLOAD_ON})
-            self._refresh_config_watermark()
-        elif self.is_ad410 and topic == self.entity_siren_volume.command_topics["command"]:
-            new_volume = clamp(int(payload), min=0, max=100)
-            logger.info(f"Setting Siren Volume to {new_volume}%")
-            self.camera.set_config({CONFIG_SIREN_VOLUME: new_volume})
-            self._refresh_config_siren_volume()
-        elif self.is_ad410 and topic == self.entity_flashlight.command_topics["command"]:
-            if payload == PAYLOAD_ON:
-                logger.info(f"Setting Flashlight to {payload}")
-                self.camera.set_config({CONFIG_LIGHT_MODE: "ForceOn", CONFIG_LIGHT_STATE: "On"})
-                self.entity_flashlight.publish(PAYLOAD_ON)
-                self.entity_flashlight.publish(LIGHT_EFFECT_NONE, "effect")
-            elif payload == PAYLOAD_OFF:
-                logger.info(f"Setting Flashlight to {payload}")
-                self.camera.set_config({CONFIG_LIGHT_MODE: "Off"})
-                self.entity_flashlight.publish(PAYLOAD_OFF)
-            else:
-                logger.warning(f"Unknown Flashlight payload {payload}")
-        elif self.is_ad410 and topic == self.entity_flashlight.command_topics["effect_command"]:
-            set_config_state = None
-            if payload == LIGHT_EFFECT_NONE:
-                set_config_state = "On"
-            elif payload == LIGHT_EFFECT_STROBE:
-                set_config_state = "Flicker"
-
-            if set_config_state:
-                logger.info(f"Setting Flashlight mode to {payload}")
-                self.camera.set_config(
-                    {
-                        CONFIG_LIGHT_MODE: "ForceOn",
-                        CONFIG_LIGHT_STATE: set_config_state,
-                    }
-                )
-                self.entity_flashlight.publish(payload, "effect")
-            else:
-                logger.warning(f"Unknown Flashlight effect payload {payload}")
+    def publish_event(self, code, payload, received_at: t.Optional[float] = None):
+        # Events are only retained for a while, with their code and time as MQTT v5 user properties
+        received_time = time.time()
+        if received_at is not None:
+            received_time -= time.monotonic() - received_at
+        timestamp = datetime.fromtimestamp(received_time, timezone.utc)
+
+        if self.event_encoding == EVENT_ENCODING_JSON:
+            payload_kwargs = {"json": True}
         else:
+            payload = self.event_encoder.encode(payload)
+            payload_kwargs = {}
+
+        self.mqtt_publish(
+            self.device.event_topic,
+            payload,
+            expiry=self.mqtt_event_expiry,
+            user_properties={"code": code, "timestamp": timestamp.isoformat()},
+            **payload_kwargs,
+        )
+        if received_at is not None and self.latency_metrics:
+            self.latency.record("event", received_at)
+
+    def publish_event_batch(self, payloads: t.List[dict]):
+        """Publish the events collected by `event_batcher` as a single list"""
+        self.mqtt_publish(
+            self.device.event_topic,
+            self.event_encoder.encode(payloads),
+            expiry=self.mqtt_event_expiry,
+            user_properties={"count": str(len(payloads))},
+        )
+
+    def trigger_snapshot(self, reason: str):
+        if self.snapshot_pipeline is not None:
+            self.snapshot_pipeline.trigger(reason)
+
+    def handle_mqtt_message(self, topic: str, payload: str):
+        command = self.entities.commands.get(topic)
+        if command is None:
             logger.warning(f'Received message at unsupported command topic "{topic}"')
+            return
 
-    def _refresh_config_siren_volume(self):
-        siren_volume = self.camera.get_config(CONFIG_SIREN_VOLUME, int)
-        self.entity_siren_volume.publish(siren_volume)
+        entity, definition, command_definition = command
 
-    def _refresh_config_watermark(self):
-        watermark_is_enabled = self.camera.get_config(CONFIG_WATERMARK, str2bool)
-        self.entity_watermark.publish(PAYLOAD_ON if watermark_is_enabled else PAYLOAD_OFF)
+        if command_definition.payloads is not None:
+            action = command_definition.payloads.get(payload)
+            if action is None:
+                logger.warning(f"Unknown {entity.name} payload {payload}")
+                return
+            logger.info(f"Setting {entity.name} to {payload}")
+            self.command_pipeline.submit(entity, action.set, action.state)
+        else:
+            value = command_definition.to_value(payload)
+            logger.info(f"Setting {entity.name} to {value}")
+            # The entity's state follows from its config key
+            self.command_pipeline.submit(entity, {definition.state.config_key: value}, {})
 
-    def _refresh_config_indicator_light(self):
-        indicator_light_is_enabled = self.camera.get_config(CONFIG_INDICATOR_LIGHT, str2bool)
-        self.entity_indicator_light.publish(
-            PAYLOAD_ON if indicator_light_is_enabled else PAYLOAD_OFF
-        )
+    def publish_state(
+        self,
+        name_slug: str,
+        payload: t.Any,
+        topic: str = None,
+        received_at: t.Optional[float] = None,
+    ):
+        """
+        Publish to an entity by name slug, if the device has that entity
+
+        With `received_at`, the time from receiving the event to the broker acknowledging the
+        publish is tracked as the entity's latency
+        """
+        entity = self.entities.get(name_slug)
+        if entity is not None:
+            entity.publish(payload, topic)
+            if received_at is not None and self.latency_metrics:
+                self.latency.record(name_slug, received_at)
+
+    def refresh_entity_states(self, config_keys: t.Iterable[str]):
+        values = self.camera.get_configs(config_keys)
+        for key, value in values.items():
+            for entity, state in self.entities.states[key]:
+                entity.publish(state.to_payload(value))
 
     def _send_doorbell_off(self):
         logger.info(f"Didn't receive doorbell off message within {self.doorbell_off_timeout:.1f} sec")
-        self.entity_doorbell.publish(PAYLOAD_OFF)
+        self.publish_state("doorbell", PAYLOAD_OFF)
         self.doorbell_off_timer = None
 
-    def refresh_config_sensors(self, initial=False):
-        Timer(self.config_poll_interval, self.refresh_config_sensors).start()
-        if initial:
-            logger.info("Performing initial fetch of config sensors...")
-        else:
-            logger.info("Fetching config sensors...")
-
-        if self.is_ad410:
-            self._refresh_config_siren_volume()
-            self._refresh_config_watermark()
-            self._refresh_config_indicator_light()
+    def schedule_poll(self, name: str, interval: float, function: t.Callable[[], t.Any]):
+        """
+        (Re)schedule a poller to run in `interval` seconds, replacing any pending run of it;
+        an interval of 0 disables the poller
+        """
+        with self._poll_timers_lock:
+            timer = self._poll_timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            if interval > 0 and not self.stopped.is_set():
+                self._poll_timers[name] = Timer(interval, function)
+                self._poll_timers[name].start()
+
+    def refresh_config_sensors(self):
+        self.schedule_poll("config", self.config_poll_interval, self.refresh_config_sensors)
+        if not self.is_active:
+            return
+
+        logger.info("Fetching config sensors...")
+        self.refresh_config_state()
+
+    def refresh_config_state(self):
+        if self.entities.config_keys:
+            try:
+                self.refresh_entity_states(self.entities.config_keys)
+            except AmcrestError as error:
+                logger.warning(f"Error fetching config sensors: {error}")
+
+    def refresh_health_sensors(self):
+        self.schedule_poll("health", self.storage_poll_interval, self.refresh_health_sensors)
+
+        # Fetched on standby too, so taking over can publish health without waiting on the camera
+        logger.info("Fetching health sensors...")
+        health = self.health_poller.fetch()
+        if self.is_active:
+            self.health_poller.publish(health)
+
+    def refresh_latency_sensors(self):
+        self.schedule_poll("latency", LATENCY_PUBLISH_INTERVAL, self.refresh_latency_sensors)
+        if not self.is_active:
+            return
+
+        p50, p95, p99 = self.latency.overall.percentiles(50, 95, 99)
+        for name_slug, value in (("latency_p50", p50), ("latency_p95", p95), ("latency_p99", p99)):
+            if value is not None:
+                self.publish_state(name_slug, value)
+        summary = self.latency.summary()
+        self.mqtt_publish(
+            self.device.latency_topic,
+            {**summary, "commands": self.command_rtt.summary()},
+            json=True,
+        )
 
-    def refresh_storage_sensors(self, initial=False):
-        Timer(self.storage_poll_interval, self.refresh_storage_sensors).start()
-        if initial:
-            logger.info("Performing initial fetch of storage sensors...")
-        else:
-            logger.info("Fetching storage sensors...")
+        if self.latency_slo > 0 and p95 is not None:
+            breached = p95 > self.latency_slo
+            if breached and not self._latency_slo_breached:
+                slowest, latency = max(summary.items(), key=lambda item: item[1]["p95"] or 0)
+                logger.warning(
+                    f"Event-to-state latency SLO breached: p95 is {p95:.0f}ms, above "
+                    f'{self.latency_slo:.0f}ms (slowest: "{slowest}" at {latency["p95"]:.0f}ms)'
+                )
+            elif not breached and self._latency_slo_breached:
+                logger.info(f"Event-to-state latency back within SLO: p95 is {p95:.0f}ms")
+            if breached != self._latency_slo_breached:
+                self.publish_state("latency_slo_breached", PAYLOAD_ON if breached else PAYLOAD_OFF)
+                self._latency_slo_breached = breached
+
+    def schedule_rollup(self, window: str):
+        # Aligned on the wall clock, e.g. on the minute
+        self.schedule_poll(
+            f"rollup_{window}",
+            self.aggregator.until_next(ROLLUP_WINDOWS[window]),
+            lambda: self.publish_rollup(window),
+        )
 
-        try:
-            storage = self.camera.storage_all
-            self.entity_storage_used_percent.publish(storage["used_percent"])
-            self.entity_storage_used.publish(storage["used"][0])
-            self.entity_storage_total.publish(storage["total"][0])
-        except AmcrestError as error:
-            logger.warning(f"Error fetching storage information: {error}")
+    def publish_rollup(self, window: str):
+        self.schedule_rollup(window)
+        rollup = self.aggregator.rollup(window)
+        if self.is_active:
+            self.mqtt_publish(
+                f"{self.device.rollup_topic}/{window}", rollup, exit_on_error=False, json=True
+            )
 
     def ping_camera(self):
+        if self.stopped.is_set():
+            return
         Timer(TIME_CAMERA_PING_INTERVAL, self.ping_camera).start()
 
         if not ping(self.amcrest_host, timeout=TIME_CAMERA_PING_TIMEOUT):
             logger.error("Ping unsuccessful")
             self.exit_gracefully(1)
 
+    def read_config_file(self) -> t.Dict[str, t.Any]:
+        """
+        Read settings from `config_file`, a JSON object of field names to values, e.g.
+        `{"config_poll_interval": 30, "log_level": "DEBUG"}`
+        """
+        with open(self.config_file, encoding="utf-8") as file:
+            config = json.load(file)
+        if not isinstance(config, dict):
+            raise ValueError(f'Config file "{self.config_file}" must contain a JSON object')
+
+        fields = {field.name: field for field in dataclasses.fields(self)}
+        del fields["config_file"]
+        unknown = sorted(set(config) - set(fields))
+        if unknown:
+            raise ValueError(f'Unknown settings in config file "{self.config_file}": {unknown}')
+
+        # Validated as a whole, so a bad value never leaves the config half applied
+        settings = {}
+        errors = []
+        for name, value in config.items():
+            try:
+                settings[name] = self.convert_setting(fields[name], value)
+            except (TypeError, ValueError) as error:
+                errors.append(f'"{name}" {error}')
+        if errors:
+            raise ValueError(
+                f'Invalid settings in config file "{self.config_file}": {"; ".join(errors)}'
+            )
+        return settings
+
+    @staticmethod
+    def convert_setting(field: dataclasses.Field, value: t.Any) -> t.Any:
+        """Convert a setting to its field's type, the way the command line parser does"""
+        type_ = field.type
+        if t.get_origin(type_) is t.Union:  # i.e. `t.Optional[...]`
+            type_ = next(arg for arg in t.get_args(type_) if arg is not type(None))
+            if value is None:
+                return None
+        if value is None:
+            if field.default is None:
+                return None
+            raise ValueError("can't be null")
+
+        if type_ is bool:
+            if not isinstance(value, (bool, int, str)):
+                raise TypeError(f"must be a boolean, not {value!r}")
+            value = str2bool(value)
+        elif type_ in (int, float):
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise TypeError(f"must be a number, not {value!r}")
+            try:
+                value = type_(value)
+            except ValueError:
+                raise ValueError(f"must be a number, not {value!r}") from None
+        elif not isinstance(value, str):
+            raise TypeError(f"must be a string, not {value!r}")
+
+        if field.name == "log_level":
+            value = value.upper()
+            if not isinstance(logging.getLevelName(value), int):
+                raise ValueError(f'must be a log level, e.g. "INFO", not {value!r}')
+        choices = FIELD_CHOICES.get(field.name)
+        if choices is not None and value not in choices:
+            raise ValueError(f"must be one of {list(choices)}, not {value!r}")
+        return value
+
+    def watch_config_file(self):
+        """Reload whenever the config file is modified"""
+        mtime = None
+        while True:
+            try:
+                current = os.stat(self.config_file).st_mtime_ns
+            except OSError:
+                current = None
+            if mtime is not None and current is not None and current != mtime:
+                logger.info(f'Config file "{self.config_file}" changed')
+                self.reload()
+            mtime = current if current is not None else mtime
+            time.sleep(TIME_CONFIG_FILE_POLL)
+
+    def reload(self):
+        """
+        Re-read the config file and apply changes in place: pollers are rescheduled and camera
+        credentials are swapped without dropping the event stream
+        """
+        with self._reload_lock:
+            try:
+                config = self.read_config_file()
+            except (OSError, ValueError) as error:
+                logger.error(f"Could not reload config, keeping the current one: {error}")
+                return
+
+            changed = {
+                name: value for name, value in config.items() if getattr(self, name) != value
+            }
+            # Toggling health polling adds or removes entities
+            if "storage_poll_interval" in changed and (
+                (changed["storage_poll_interval"] > 0) != (self.storage_poll_interval > 0)
+            ):
+                logger.warning("Enabling or disabling health polling requires a restart")
+                del changed["storage_poll_interval"]
+            for name in sorted(set(changed) - RELOADABLE_FIELDS):
+                logger.warning(f'Changing "{name}" requires a restart, ignoring')
+                del changed[name]
+
+            if not changed:
+                logger.info("Reloaded config, nothing changed")
+                return
+
+            for name, value in changed.items():
+                setattr(self, name, value)
+            logger.info(f"Reloaded config, changed: {', '.join(sorted(changed))}")
+
+            if "log_level" in changed:
+                logging.getLogger().setLevel(self.log_level)
+
+            if "amcrest_username" in changed or "amcrest_password" in changed:
+                self.camera.set_credentials(self.amcrest_username, self.amcrest_password)
+                if self.snapshot_pipeline is not None:
+                    self.snapshot_pipeline.camera.set_credentials(
+                        self.amcrest_username, self.amcrest_password
+                    )
+
+            if "config_poll_interval" in changed:
+                self.schedule_poll("config", self.config_poll_interval, self.refresh_config_sensors)
+            if "storage_poll_interval" in changed:
+                self.schedule_poll(
+                    "health", self.storage_poll_interval, self.refresh_health_sensors
+                )
+
+            if "snapshot_min_interval" in changed and self.snapshot_pipeline is not None:
+                self.snapshot_pipeline.min_interval = self.snapshot_min_interval
+
+    def reload_signal_handler(self, sig, frame):
+        # Reload off the main thread, which is busy reading the event stream
+        if self.config_file:
+            Thread(target=self.reload, name="reload", daemon=True).start()
+        else:
+            logger.warning("Received SIGHUP without a config file to reload")
+
+    def start_diagnostics(self, action: str, duration: float = DEFAULT_DIAGNOSTICS_DURATION):
+        if action not in ("profile", "trace"):
+            logger.warning(f'Unknown diagnostics action "{action}", expected "profile" or "trace"')
+            return
+        duration = clamp(duration, min=0, max=DIAGNOSTICS_MAX_DURATION)
+        Thread(
+            target=self.run_diagnostics, args=(action, duration), name="diagnostics", daemon=True
+        ).start()
+
+    def run_diagnostics(self, action: str, duration: float):
+        """
+        Sample the stacks of every thread ("profile"), or time the stages of handling events
+        ("trace"), for `duration` seconds; the result is written to `diagnostics_dir` as folded
+        stacks, and its path published to the diagnostics topic
+        """
+        logger.info(f"Starting {duration:.0f}s {action}...")
+        if action == "profile":
+            stacks = self.profiler.profile(duration)
+        else:
+            stacks = self.tracer.trace(duration)
+        if stacks is None:
+            logger.warning(f"A {action} is already running")
+            return
+
+        path = write_folded(self.diagnostics_dir, f"{action}-{self.device.serial_no}", stacks)
+        logger.info(f'Wrote {action} to "{path}"')
+        self.mqtt_publish(
+            self.device.diagnostics_topic,
+            {"action": action, "duration": duration, "path": path, "total": sum(stacks.values())},
+            exit_on_error=False,
+            json=True,
+        )
+
+    def diagnostics_signal_handler(self, sig, frame):
+        self.start_diagnostics("profile" if sig == signal.SIGUSR1 else "trace")
+
     def signal_handler(self, sig, frame):
         # Exit immediately upon receiving a second SIGINT
         global _is_exiting
@@ -0,0 +1,120 @@
+"""
+Startup benchmark: how long each entry point takes to import, and how much memory it adds to a
+bare interpreter, measured in fresh processes and checked against `STARTUP_BUDGETS`
+
+    python -m amcrest2mqtt.benchmark [--runs N] [--slack FACTOR] [--importtime SCENARIO]
+
+Exits with status 1 if any scenario is over budget.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import typing as t
+
+from .const import *
+
+
+# Modules imported by each scenario: parsing arguments, supervising workers, running a camera
+SCENARIOS = {
+    "cli": ["amcrest2mqtt.__main__"],
+    "supervisor": ["amcrest2mqtt.__main__", "amcrest2mqtt.supervisor"],
+    "camera": ["amcrest2mqtt.__main__", "amcrest2mqtt.amcrest2mqtt"],
+}
+
+_PROBE = """
+import json, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+seconds = time.perf_counter() - start
+try:
+    with open("/proc/self/status") as status:
+        rss = next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:"))
+except OSError:  # Not Linux; peak rather than current memory, in bytes on macOS
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if {macos!r} else 1024)
+print(json.dumps({{"seconds": seconds, "rss": rss}}))
+"""
+
+
+def measure(modules: t.List[str], runs: int) -> t.Tuple[float, float]:
+    """Median import time (milliseconds) and resident memory (MiB) over `runs` fresh processes"""
+    code = _PROBE.format(modules=modules, macos=sys.platform == "darwin")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output))
+    return (
+        statistics.median(sample["seconds"] for sample in samples) * 1000,
+        statistics.median(sample["rss"] for sample in samples) / 1024 / 1024,
+    )
+
+
+def slowest_imports(modules: t.List[str], count: int = 15) -> t.List[t.Tuple[int, str]]:
+    """Imports taking the longest, cumulatively in microseconds, nested ones indented"""
+    code = "".join(f"import {module}\n" for module in modules)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], check=True, capture_output=True, text=True
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m amcrest2mqtt.benchmark")
+    parser.add_argument("--runs", metavar="N", default=STARTUP_BENCHMARK_RUNS, type=int)
+    parser.add_argument(
+        "--slack",
+        metavar="FACTOR",
+        help="Multiplies the time budgets, for slower machines (e.g. a Raspberry Pi)",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--importtime",
+        metavar="SCENARIO",
+        help="List the slowest imports of a scenario instead",
+        choices=list(SCENARIOS),
+    )
+    args = parser.parse_args()
+
+    if args.importtime:
+        for cumulative, name in slowest_imports(SCENARIOS[args.importtime]):
+            print(f"{cumulative / 1000:8.1f}ms {name}")
+        return
+
+    base_ms, base_mib = measure([], args.runs)
+    print(f"Bare interpreter: {base_mib:.1f}MiB")
+    print(f"{'scenario':<12}{'import':>10}{'budget':>10}{'memory':>12}{'budget':>10}")
+
+    over_budget = False
+    for name, modules in SCENARIOS.items():
+        import_ms, mib = measure(modules, args.runs)
+        import_ms, mib = import_ms - base_ms, mib - base_mib
+        budget_ms, budget_mib = STARTUP_BUDGETS[name]
+        budget_ms *= args.slack
+        over = import_ms > budget_ms or mib > budget_mib
+        over_budget |= over
+        print(
+            f"{name:<12}{import_ms:>8.1f}ms{budget_ms:>8.0f}ms{mib:>9.1f}MiB{budget_mib:>7}MiB"
+            + ("  OVER BUDGET" if over else "")
+        )
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
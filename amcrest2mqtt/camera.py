@@ -6,12 +6,16 @@ from .const import *
 from .device import Device
 
 
-__all__ = ["Camera", "AmcrestError"]
+__all__ = ["Camera", "AmcrestError", "SnapshotTooLargeError"]
 
 
 _T = t.TypeVar("_T")
 
 
+class SnapshotTooLargeError(Exception):
+    pass
+
+
 class Camera:
     """
     Wrapper for amcrest.AmcrestCamera().camera, which is an instance of amcrest.ApiWrapper()
@@ -33,29 +37,92 @@ class Camera:
     def __getattr__(self, attr):
         return getattr(self._camera, attr)
 
+    def set_credentials(self, username: str, password: str):
+        """
+        Use new credentials from the next request on, without dropping open connections (e.g. the
+        event stream keeps its connection, and only uses the new credentials when reconnecting)
+        """
+        with self._camera._token_lock:
+            self._camera._user = username
+            self._camera._password = password
+            self._camera._token = None  # Regenerated on the next request
+
     def get_config(self, name: str, type: t.Callable[[str], _T] = str) -> _T:
         ret = self._camera.command(f"configManager.cgi?action=getConfig&name={name}")
         line = ret.content.decode().strip()  # Should be of the form "key.subkey.subsubkey=value"
         _, _, value = line.partition("=")
         return type(value.strip())
 
+    def get_configs(self, names: t.Iterable[str]) -> t.Dict[str, str]:
+        """
+        Fetch several config values at once, with a single request per config table
+
+        e.g. `"Lighting_V2[0][0][1].Mode"` and `"Lighting_V2[0][0][1].State"` are both read from
+        the `Lighting_V2` table
+        """
+        names = set(names)
+        tables = {name.partition(".")[0].partition("[")[0] for name in names}
+        values = {}
+        for table in sorted(tables):
+            ret = self.get_table(f"configManager.cgi?action=getConfig&name={table}")
+            for key, value in ret.items():
+                if key.startswith("table."):
+                    key = key[len("table.") :]
+                if key in names:
+                    values[key] = value
+        return values
+
     def get_config_all(self):
-        ret = self._camera.command(f"configManager.cgi?action=getConfig&name=All")
+        return self.get_table("configManager.cgi?action=getConfig&name=All")
+
+    def get_table(self, cmd: str) -> t.Dict[str, str]:
+        """
+        Run a command whose response is made of "key=value" lines, returning them as a dict
+        """
+        ret = self._camera.command(cmd)
         obj = dict()
         for line in ret.content.decode().strip().splitlines():
             key, _, value = line.partition("=")
-            obj[key] = value
+            obj[key.strip()] = value.strip()
         return obj
 
+    @staticmethod
+    def format_config_value(value: t.Any) -> str:
+        """Format a config value the way the camera reports it"""
+        if isinstance(value, bool):
+            return str(value).lower()  # "true" or "false"
+        return str(value)
+
     def set_config(self, values: t.Dict[str, t.Any]):
         url = "configManager.cgi?action=setConfig"
         for key, value in values.items():
-            if isinstance(value, bool):
-                value = str(value).lower()  # "true" or "false"
-            url += f"&{key}={value}"
+            url += f"&{key}={self.format_config_value(value)}"
         ret = self._camera.command(url)
         return "ok" in ret.content.decode().lower()
 
+    def snapshot_into(self, buffer: bytearray) -> int:
+        """
+        Read a JPEG snapshot directly into `buffer`, returning the number of bytes read
+
+        Raises `SnapshotTooLargeError` if the snapshot doesn't fit in `buffer`
+        """
+        ret = self._camera.command("snapshot.cgi", timeout_cmd=CAMERA_SNAPSHOT_TIMEOUT, stream=True)
+        view = memoryview(buffer)
+        size = 0
+        try:
+            while size < len(view):
+                count = ret.raw.readinto(view[size:])
+                if not count:
+                    break
+                size += count
+            else:
+                if ret.raw.read(1):
+                    raise SnapshotTooLargeError(f"Snapshot exceeds {len(view)} bytes")
+        finally:
+            view.release()
+            ret.close()
+        return size
+
     def get_device(self):
         device_type = self._camera.device_type.replace("type=", "").strip()
         serial_number = self._camera.serial_number.strip()
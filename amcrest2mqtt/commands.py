@@ -0,0 +1,242 @@
+from __future__ import annotations
+from functools import partial
+import logging
+from threading import Lock, Timer
+import time
+import typing as t
+
+from .camera import Camera, AmcrestError
+from .const import *
+from .entity import Entity
+from .registry import EntityTable
+
+if t.TYPE_CHECKING:
+    from .latency import LatencyTracker
+
+
+__all__ = ["CommandPipeline", "PendingCommand"]
+
+
+logger = logging.getLogger(__name__)
+
+
+# An entity state, by entity and topic relative to its `base_topic` ("" for the base topic)
+StateKey = t.Tuple[Entity, str]
+
+
+class PendingCommand:
+    __slots__ = ("entity", "values", "states", "previous", "started_at")
+
+    def __init__(
+        self,
+        entity: Entity,
+        values: t.Dict[str, str],
+        states: t.Dict[StateKey, t.Any],
+        previous: t.Dict[StateKey, t.Any],
+    ):
+        self.entity = entity
+        # Camera config values set, formatted as the camera reports them
+        self.values = values
+        # Optimistically published states, and the states published before them
+        self.states = states
+        self.previous = previous
+        self.started_at = time.monotonic()
+
+
+class CommandPipeline:
+    """
+    Runs entity commands the same way whatever the entity: the expected state is published right
+    away, then the command is sent to the camera and confirmed asynchronously, either by an event
+    reporting the expected state (see `confirm()`) or by reading the config back
+
+    Read-backs are batched: commands sent within `TIME_COMMAND_READBACK` seconds of each other
+    are read back together, with one request per config table. If the camera reports other values
+    (or the command fails), the state is rolled back to the camera's, or to the state published
+    before the command if it can't be derived from the config.
+
+    The round-trip time of confirmed commands is tracked per entity in `rtt`, if given.
+    """
+
+    def __init__(
+        self,
+        camera: Camera,
+        entities: EntityTable,
+        metrics: t.Counter[str],
+        rtt: t.Optional[LatencyTracker] = None,
+    ):
+        self.camera = camera
+        self.entities = entities
+        self.metrics = metrics
+        self.rtt = rtt
+        # By entity name slug; a newer command for an entity replaces the pending one
+        self._pending: t.Dict[str, PendingCommand] = {}
+        self._readback: t.List[PendingCommand] = []
+        self._readback_timer: t.Optional[Timer] = None
+        self._lock = Lock()
+        # Last published state of entities with commands, to roll back to
+        self._published: t.Dict[StateKey, t.Any] = {}
+
+        tracked = set()
+        for entity, definition, _ in entities.commands.values():
+            tracked.add(entity)
+            if definition.state is not None:
+                tracked.update(entity for entity, _ in entities.states[definition.state.config_key])
+        for entity in tracked:
+            entity.register_publish_callback(partial(self._remember, entity))
+
+    def _remember(self, entity: Entity, payload: t.Any, topic: t.Optional[str] = None):
+        self._published[(entity, topic or "")] = payload
+
+    def submit(self, entity: Entity, values: t.Dict[str, t.Any], states: t.Dict[str, t.Any]):
+        """
+        Set camera config `values` for a command of `entity`, which should result in `states`
+        (by topic relative to the entity's `base_topic`)
+        """
+        formatted = {key: Camera.format_config_value(value) for key, value in values.items()}
+        expected = {(entity, topic): payload for topic, payload in states.items()}
+        # Entities sharing a config key with the command's change with it
+        for key, value in formatted.items():
+            for related, state in self.entities.states.get(key, []):
+                expected[(related, "")] = state.to_payload(value)
+
+        previous = {state_key: self._published.get(state_key) for state_key in expected}
+        self.metrics["commands"] += 1
+        with self._lock:
+            replaced = self._pending.get(entity.name_slug)
+            if replaced is not None:
+                # Roll back past the replaced command too, as it wasn't confirmed either
+                previous.update(
+                    (state_key, payload)
+                    for state_key, payload in replaced.previous.items()
+                    if state_key in previous
+                )
+            command = PendingCommand(entity, formatted, expected, previous)
+            self._pending[entity.name_slug] = command
+        self._publish(command.states)
+
+        try:
+            ok = self.camera.set_config(values)
+        except AmcrestError as error:
+            logger.warning(f"Error setting {entity.name}: {error}")
+            ok = False
+        if not ok:
+            with self._lock:
+                if self._pending.get(entity.name_slug) is command:
+                    del self._pending[entity.name_slug]
+            self._roll_back(command, {})
+            return
+
+        with self._lock:
+            if self._pending.get(entity.name_slug) is not command:
+                return  # Already confirmed by an event, or replaced by a newer command
+            self._readback.append(command)
+            if self._readback_timer is None:
+                self._readback_timer = Timer(TIME_COMMAND_READBACK, self._read_back)
+                self._readback_timer.daemon = True
+                self._readback_timer.start()
+
+    def confirm(self, name_slug: str, states: t.Dict[str, t.Any]):
+        """
+        Confirm a pending command of an entity (by name slug) if an event reports the states
+        (by topic relative to its `base_topic`) it expects
+
+        Other states are left to the read-back, as events may report intermediate states
+        """
+        with self._lock:
+            command = self._pending.get(name_slug)
+            if command is None:
+                return
+            for topic, payload in states.items():
+                if command.states.get((command.entity, topic), payload) != payload:
+                    return
+            del self._pending[name_slug]
+        self._confirmed(command, "event")
+
+    def _read_back(self):
+        with self._lock:
+            commands, self._readback = self._readback, []
+            self._readback_timer = None
+            commands = [
+                command
+                for command in commands
+                if self._pending.get(command.entity.name_slug) is command
+            ]
+        if not commands:
+            return
+
+        try:
+            actual = self.camera.get_configs(
+                {key for command in commands for key in self._config_keys(command.entity)}
+            )
+        except AmcrestError as error:
+            # Nothing to roll back to; the next config poll publishes the camera's state
+            logger.warning(f"Error reading back commands: {error}")
+            with self._lock:
+                for command in commands:
+                    if self._pending.get(command.entity.name_slug) is command:
+                        del self._pending[command.entity.name_slug]
+            return
+
+        for command in commands:
+            with self._lock:
+                if self._pending.get(command.entity.name_slug) is not command:
+                    continue
+                del self._pending[command.entity.name_slug]
+            if all(actual.get(key) == value for key, value in command.values.items()):
+                self._confirmed(command, "read-back")
+            else:
+                self._roll_back(command, actual)
+
+    def _confirmed(self, command: PendingCommand, by: str):
+        rtt = time.monotonic() - command.started_at
+        logger.debug(f"{command.entity.name} confirmed by {by} after {rtt * 1000:.0f}ms")
+        if self.rtt is not None:
+            self.rtt.record(command.entity.name_slug, command.started_at)
+
+    def _roll_back(self, command: PendingCommand, actual: t.Dict[str, str]):
+        """Publish the camera's state, derived from `actual` config values where possible"""
+        states = self._states_from_config(command.entity, actual)
+        rolled_back = {}
+        for state_key, payload in command.states.items():
+            payload = states.get(state_key, command.previous[state_key])
+            if payload is not None:
+                rolled_back[state_key] = payload
+        logger.warning(f"Camera didn't apply {command.entity.name} command, rolling back its state")
+        self.metrics["command_rollbacks"] += 1
+        self._publish(rolled_back)
+
+    def _config_keys(self, entity: Entity) -> t.Set[str]:
+        """Every config key that the entity's state can be derived from"""
+        definition = self.entities.definitions[entity.name_slug]
+        keys = {
+            key
+            for command in definition.commands.values()
+            for action in (command.payloads or {}).values()
+            for key in action.set
+        }
+        if definition.state is not None:
+            keys.add(definition.state.config_key)
+        return keys
+
+    def _states_from_config(
+        self, entity: Entity, actual: t.Dict[str, str]
+    ) -> t.Dict[StateKey, t.Any]:
+        states = {}
+        for key, value in actual.items():
+            for related, state in self.entities.states.get(key, []):
+                states[(related, "")] = state.to_payload(value)
+        # Payload commands map to states through the config values their actions set
+        for command in self.entities.definitions[entity.name_slug].commands.values():
+            for action in (command.payloads or {}).values():
+                if all(
+                    actual.get(key) == Camera.format_config_value(value)
+                    for key, value in action.set.items()
+                ):
+                    for topic, payload in action.state.items():
+                        states.setdefault((entity, topic), payload)
+        return states
+
+    @staticmethod
+    def _publish(states: t.Dict[StateKey, t.Any]):
+        for (entity, topic), payload in states.items():
+            entity.publish(payload, topic or None)
@@ -4,57 +4,116 @@ MANUFACTURER = "Amcrest"
 CAMERA_EVENTS_SPECIFIER = "All"
 CAMERA_EVENTS_RETRIES = 5
 CAMERA_EVENTS_TIMEOUT = (10.00, 3600)  # (connect timeout, read timeout)
+CAMERA_SNAPSHOT_TIMEOUT = (5.00, 10.00)  # (connect timeout, read timeout)
 
 COMPONENT_BINARY_SENSOR = "binary_sensor"
+COMPONENT_CAMERA = "camera"
 COMPONENT_LIGHT = "light"
 COMPONENT_NUMBER = "number"
 COMPONENT_SENSOR = "sensor"
 COMPONENT_SWITCH = "switch"
 
-CONFIG_SIREN_VOLUME = "VideoTalkPhoneGeneral.RingVolume"
-CONFIG_LIGHT_MODE = "Lighting_V2[0][0][1].Mode"
-CONFIG_LIGHT_STATE = "Lighting_V2[0][0][1].State"
-CONFIG_WATERMARK = "VideoWidget[0].PictureTitle.EncodeBlend"
-CONFIG_INDICATOR_LIGHT = "LightGlobal[0].Enable"
-
 DEFAULT_AMCREST_PORT = 80
 DEFAULT_AMCREST_USERNAME = "admin"
+DEFAULT_DIAGNOSTICS_DURATION = 30.0
 DEFAULT_DOORBELL_OFF_TIMEOUT = 10.0
+DEFAULT_EVENT_BATCH_COMPRESSION = False
+DEFAULT_EVENT_BATCH_WINDOW = 0.0
+DEFAULT_EVENT_ENCODING = "json"
 DEFAULT_STORAGE_POLL_INTERVAL = 3600
 DEFAULT_CONFIG_POLL_INTERVAL = 60
+DEFAULT_LATENCY_METRICS = False
+DEFAULT_LATENCY_SLO = 0.0
 DEFAULT_MQTT_HOST = "localhost"
 DEFAULT_MQTT_QOS = 0
+DEFAULT_MQTT_PROTOCOL = "3.1.1"
+DEFAULT_MQTT_EVENT_EXPIRY = 3600
 DEFAULT_MQTT_PORT = 1883
 DEFAULT_HOME_ASSISTANT_PREFIX = "homeassistant"
-
-DEVICE_CLASS_MOTION = "motion"
+DEFAULT_HIGH_AVAILABILITY = False
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_HA_LEASE_TTL = 5.0
+DEFAULT_REPLAY_SPEED = 1.0
+DEFAULT_ROLLUPS = False
+DEFAULT_SNAPSHOTS = False
+DEFAULT_SNAPSHOT_MIN_INTERVAL = 5.0
+DEFAULT_SNAPSHOT_MAX_WIDTH = 0
+DEFAULT_SNAPSHOT_PREBUFFER_SIZE = 0
+DEFAULT_SNAPSHOT_PREBUFFER_INTERVAL = 1.0
+DEFAULT_WORKERS = 0
 
 DEVICE_TYPE_AD110 = "AD110"
 DEVICE_TYPE_AD410 = "AD410"
 
-ENTITY_CATEGORY_CONFIG = "config"
-ENTITY_CATEGORY_DIAGNOSTIC = "diagnostic"
+DIAGNOSTICS_MAX_DURATION = 600.0  # Seconds
+DIAGNOSTICS_SAMPLE_INTERVAL = 0.01  # Seconds
+
+EVENT_BATCH_MAX_SIZE = 500
+EVENT_ENCODING_CBOR = "cbor"
+EVENT_ENCODING_JSON = "json"
+EVENT_ENCODING_MSGPACK = "msgpack"
 
-ICON_FACE_RECOGNITION = "mdi:face-recognition"
-ICON_FLASHLIGHT = "mdi:flashlight"
-ICON_MICRO_SD = "mdi:micro-sd"
-ICON_VOLUME_HIGH = "mdi:volume-high"
-ICON_WATERMARK = "mdi:watermark"
-ICON_RADIOBOX_MARKED = "mdi:radiobox-marked"
-ICON_CIRCLE_OUTLINE = "mdi:circle-outline"
+FEATURE_HEALTH = "health"
+FEATURE_LATENCY = "latency"
+FEATURE_LATENCY_SLO = "latency_slo"
+FEATURE_SNAPSHOTS = "snapshots"
+
+LATENCY_BUCKET_GROWTH = 1.25  # Each histogram bucket is this much wider than the previous one
+LATENCY_BUCKET_MIN = 1.0  # Milliseconds
+LATENCY_BUCKETS = 64  # Up to ~20 minutes
+LATENCY_PUBLISH_INTERVAL = 60  # Seconds
+LATENCY_SLOT_DURATION = 60  # Seconds
+LATENCY_WINDOW_SLOTS = 5  # Percentiles cover the last LATENCY_WINDOW_SLOTS * LATENCY_SLOT_DURATION
+
+LEADER_HEARTBEATS_PER_TTL = 5
 
 LIGHT_EFFECT_NONE = "None"
 LIGHT_EFFECT_STROBE = "Strobe (30sec)"
 
 MISSING = object()  # Sentinel
 
+MQTT_PROTOCOL_V311 = "3.1.1"
+MQTT_PROTOCOL_V5 = "5"
+MQTT_REASON_UNSUPPORTED_PROTOCOL_VERSION = 132
+MQTT_SESSION_EXPIRY_NEVER = 0xFFFFFFFF
+
 PAYLOAD_ON = "on"
 PAYLOAD_OFF = "off"
 PAYLOAD_ONLINE = "online"
 PAYLOAD_OFFLINE = "offline"
 
+# Distinct event codes counted per window, beyond which they're counted as "other"
+ROLLUP_MAX_CODES = 64
+ROLLUP_OTHER_CODE = "other"
+ROLLUP_WINDOWS = {"minute": 60, "hour": 3600}  # Seconds
+
+SNAPSHOT_BUFFER_SIZE = 1024 * 1024  # Bytes; large enough for a full-resolution AD410 JPEG
+SNAPSHOT_JPEG_QUALITY = 85
+# Minimum age beyond which buffered snapshots aren't worth publishing, longer with longer intervals
+SNAPSHOT_PREBUFFER_MAX_AGE = 5.0  # Seconds
+
+STARTUP_BENCHMARK_RUNS = 5  # Fresh processes per scenario, of which the median is reported
+# Import time (milliseconds) and memory (MiB) over a bare interpreter, by startup benchmark scenario
+STARTUP_BUDGETS = {
+    "cli": (60, 4),
+    "supervisor": (100, 8),
+    "camera": (750, 48),
+}
+
+SUPERVISOR_HANDOVER_DELAY = 5  # Seconds for workers to stop cameras moving to a rejoining worker
+SUPERVISOR_HASH_REPLICAS = 64  # Points per worker on the consistent hashing ring
+SUPERVISOR_MAX_BACKOFF = 60  # Seconds
+# Crashes within SUPERVISOR_RESTART_WINDOW before rebalancing a worker's cameras
+SUPERVISOR_MAX_RESTARTS = 5
+SUPERVISOR_METRICS_INTERVAL = 60  # Seconds
+SUPERVISOR_REJOIN_DELAY = 600  # Seconds before a worker whose cameras were rebalanced rejoins
+SUPERVISOR_RESTART_WINDOW = 300  # Seconds
+
 TIME_CAMERA_PING_INTERVAL = 30  # Seconds
 TIME_CAMERA_PING_TIMEOUT = 100  # Seconds
-
-UNITS_PERCENTAGE = "%"
-UNITS_GIGABYTES = "GB"
+# Commands sent within this time of each other are read back together
+TIME_COMMAND_READBACK = 1  # Seconds
+TIME_CONFIG_FILE_POLL = 5  # Seconds
+TIME_DISCOVERY_SETTLE = 0.5  # Seconds
+TIME_DISCOVERY_TIMEOUT = 5  # Seconds
+TIME_MQTT_CONNACK_TIMEOUT = 10  # Seconds
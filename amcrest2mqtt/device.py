@@ -26,6 +26,11 @@ class Device(NamedTuple):
             "via_device": self.via_device,
         }
 
+    @property
+    def ha_node_id(self) -> str:
+        """The `<node_id>` segment of this device's Home Assistant discovery topics"""
+        return f"{APP_NAME}-{self.slug}-{self.serial_no}"
+
     @property
     def topic(self) -> str:
         return f"{APP_NAME}/{self.serial_no}"
@@ -40,6 +45,26 @@ class Device(NamedTuple):
         """Not used by Home Assistant -- for purely MQTT-based uses"""
         return f"{self.topic}/event"
 
+    @property
+    def leader_topic(self) -> str:
+        """Lease topic for electing the active instance when running with high availability"""
+        return f"{self.topic}/leader"
+
+    @property
+    def diagnostics_topic(self) -> str:
+        """Commands to profile or trace the app, and their results; not used by Home Assistant"""
+        return f"{self.topic}/diagnostics"
+
+    @property
+    def latency_topic(self) -> str:
+        """Event-to-state latency percentiles by entity; not used by Home Assistant"""
+        return f"{self.topic}/latency"
+
+    @property
+    def rollup_topic(self) -> str:
+        """Event counts and durations per minute and per hour; not used by Home Assistant"""
+        return f"{self.topic}/rollup"
+
     @property
     def config_topic(self) -> str:
         """Not used by Home Assistant -- for purely MQTT-based uses"""
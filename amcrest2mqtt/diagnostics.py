@@ -0,0 +1,139 @@
+from __future__ import annotations
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import logging
+import os
+import sys
+from threading import Lock, get_ident, local, enumerate as enumerate_threads
+import time
+import typing as t
+
+from .const import *
+
+
+__all__ = ["SamplingProfiler", "StageTracer", "write_folded"]
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_folded(directory: str, name: str, stacks: t.Counter[str]) -> str:
+    """
+    Write stacks in the folded format read by flamegraph tools (`frame;frame;frame count` lines),
+    e.g. `flamegraph.pl` or speedscope, returning the path written to
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+    with open(path, "w", encoding="utf-8") as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(f"{stack} {count}\n")
+    return path
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread at a fixed interval, without instrumenting any code
+
+    Only one profile runs at a time
+    """
+
+    def __init__(self, interval: float = DIAGNOSTICS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, duration: float) -> t.Optional[t.Counter[str]]:
+        """Sample for `duration` seconds, returning sample counts by folded stack"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks: t.Counter[str] = Counter()
+            own_ident = get_ident()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in enumerate_threads()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own_ident:
+                        stacks[self._fold(names.get(ident, str(ident)), frame)] += 1
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _fold(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        frames.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(frames))
+
+
+class _Stage:
+    __slots__ = ("name", "start", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.children = 0.0
+
+
+class StageTracer:
+    """
+    Times the stages of handling events (e.g. wait, dispatch, serialize, ack) while enabled
+
+    Stages nest per thread (stages run on other threads are at the root), and their own time
+    (excluding nested stages) is accumulated in microseconds by folded stack, so the result renders
+    as a flamegraph. When disabled, `stage()` costs a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._local = local()
+        self._totals: t.Counter[str] = Counter()
+
+    def stage(self, name: str) -> t.ContextManager:
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        stack: t.List[_Stage] = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stage = _Stage(name)
+        stack.append(stage)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - stage.start
+            stack.pop()
+            if stack:
+                stack[-1].children += elapsed
+            path = ";".join([*(parent.name for parent in stack), name])
+            with self._lock:
+                self._totals[path] += round((elapsed - stage.children) * 1_000_000)
+
+    def trace(self, duration: float) -> t.Optional[t.Counter[str]]:
+        """Trace for `duration` seconds, returning microseconds spent by folded stage stack"""
+        with self._lock:
+            if self.enabled:
+                return None
+            self._totals = Counter()
+            self.enabled = True
+        try:
+            time.sleep(duration)
+        finally:
+            with self._lock:
+                self.enabled = False
+                totals, self._totals = self._totals, Counter()
+        return totals
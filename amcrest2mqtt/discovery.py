@@ -0,0 +1,140 @@
+from __future__ import annotations
+import logging
+from threading import Event, Lock
+import time
+import typing as t
+
+from .const import *
+from .entity import Entity
+from .mqtt_client import MQTTMessage, MQTTMessageInfo
+
+if t.TYPE_CHECKING:
+    from .amcrest2mqtt import Amcrest2MQTT
+
+
+__all__ = ["DiscoveryManager"]
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryManager:
+    """
+    Publishes Home Assistant discovery config for all entities of a device in one pass
+
+    The retained discovery topics already on the broker are read first, so only configs that
+    changed are published, and configs for entities that no longer exist are cleared with an
+    empty retained payload. Publishes are pipelined and command topics are subscribed to with
+    a single SUBSCRIBE.
+
+    With `watch()`, the retained discovery topics are kept cached from then on, so `publish()`
+    doesn't have to wait for the broker (e.g. for a standby instance taking over).
+    """
+
+    def __init__(self, api: "Amcrest2MQTT", entities: t.Iterable[Entity]):
+        self.api = api
+        self.entities = list(entities)
+        self._retained: t.Dict[str, str] = {}
+        self._retained_lock = Lock()
+        self._retained_activity = Event()
+        self._watching = False
+
+        for entity in self.entities:
+            entity.setup_ha(self.api)
+
+    @property
+    def topic_filter(self) -> str:
+        """Matches every discovery topic of this device, regardless of component or entity"""
+        return f"{self.api.home_assistant_prefix}/+/{self.api.device.ha_node_id}/+/config"
+
+    @property
+    def command_topics(self) -> t.List[str]:
+        return [topic for entity in self.entities for topic in entity.command_topics.values()]
+
+    def publish(self):
+        configs = {
+            entity.get_ha_config_topic(self.api.home_assistant_prefix): (
+                self.api.mqtt_client.transform_payload(entity.get_ha_config(self.api), json=True)
+            )
+            for entity in self.entities
+        }
+
+        if self._watching:
+            with self._retained_lock:
+                retained = dict(self._retained)
+        else:
+            retained = self.fetch_retained()
+
+        changed = {
+            topic: config for topic, config in configs.items() if retained.get(topic) != config
+        }
+        stale = [topic for topic in retained if topic not in configs]
+
+        logger.info(
+            f"Home Assistant discovery: {len(changed)} changed, "
+            f"{len(configs) - len(changed)} unchanged, {len(stale)} stale"
+        )
+
+        pending: t.List[MQTTMessageInfo] = []
+        for topic, config in changed.items():
+            pending.append(self.api.mqtt_publish(topic, config, wait=False))
+        for topic in stale:
+            logger.info(f'Removing stale discovery config "{topic}"')
+            pending.append(self.api.mqtt_publish(topic, "", wait=False))
+        for msg in pending:
+            if msg is not None:
+                msg.wait_for_publish()
+
+        for topic in self.command_topics:
+            logger.info(f'Subscribing to command topic "{topic}"')
+        self.api.mqtt_client.subscribe_many(self.command_topics)
+
+    def unsubscribe(self):
+        """Stop receiving commands, e.g. when going on standby"""
+        if self.command_topics:
+            self.api.mqtt_client.unsubscribe(self.command_topics)
+
+    def watch(self):
+        self._watching = True
+        self.api.mqtt_client.message_callback_add(self.topic_filter, self._on_retained_message)
+        self.api.mqtt_client.subscribe(self.topic_filter, qos=self.api.mqtt_qos)
+
+    def fetch_retained(self) -> t.Dict[str, str]:
+        """
+        Collect the retained discovery configs of this device currently held by the broker
+
+        The broker sends retained messages right after the subscription is acknowledged, so this
+        returns once no new message has arrived for `TIME_DISCOVERY_SETTLE` seconds
+        """
+        topic_filter = self.topic_filter
+        client = self.api.mqtt_client
+
+        with self._retained_lock:
+            self._retained.clear()
+        self._retained_activity.clear()
+
+        client.message_callback_add(topic_filter, self._on_retained_message)
+        try:
+            client.subscribe(topic_filter, qos=self.api.mqtt_qos)
+            deadline = time.monotonic() + TIME_DISCOVERY_TIMEOUT
+            while time.monotonic() < deadline:
+                if not self._retained_activity.wait(TIME_DISCOVERY_SETTLE):
+                    break
+                self._retained_activity.clear()
+            client.unsubscribe(topic_filter)
+        finally:
+            client.message_callback_remove(topic_filter)
+
+        with self._retained_lock:
+            return dict(self._retained)
+
+    def _on_retained_message(self, client, userdata, message: MQTTMessage):
+        # While watching, live updates (which aren't flagged as retained) keep the cache current
+        if not message.retain and not self._watching:
+            return
+        with self._retained_lock:
+            if message.payload:
+                self._retained[message.topic] = message.payload.decode()
+            else:
+                self._retained.pop(message.topic, None)
+        self._retained_activity.set()
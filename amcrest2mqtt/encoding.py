@@ -0,0 +1,88 @@
+from __future__ import annotations
+import json
+import logging
+from threading import Lock, Timer
+import typing as t
+import zlib
+
+from .const import *
+
+
+__all__ = ["EventBatcher", "EventEncoder"]
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventEncoder:
+    """
+    Encodes events published to the event topic as JSON, MessagePack (requires `msgpack`) or
+    CBOR (requires `cbor2`), optionally compressing them with zlib
+
+    Raises `ImportError` if the library an encoding needs isn't installed
+    """
+
+    def __init__(self, encoding: str = DEFAULT_EVENT_ENCODING, compress: bool = False):
+        self.encoding = encoding
+        self.compress = compress
+
+        if encoding == EVENT_ENCODING_JSON:
+            self._dumps: t.Callable[[t.Any], bytes] = lambda obj: json.dumps(obj).encode()
+        elif encoding == EVENT_ENCODING_MSGPACK:
+            import msgpack
+
+            self._dumps = lambda obj: msgpack.packb(obj, use_bin_type=True)
+        elif encoding == EVENT_ENCODING_CBOR:
+            import cbor2
+
+            self._dumps = cbor2.dumps
+        else:
+            raise ValueError(f'Unknown event encoding "{encoding}"')
+
+    def encode(self, obj: t.Any) -> bytes:
+        data = self._dumps(obj)
+        if self.compress:
+            data = zlib.compress(data)
+        return data
+
+    def as_dict(self) -> t.Dict[str, t.Any]:
+        """Describes the encoding, for consumers"""
+        return {"format": self.encoding, "compression": "zlib" if self.compress else None}
+
+
+class EventBatcher:
+    """
+    Collects events for `window` seconds after the first one, then publishes them all at once
+
+    A batch is published early once it holds `EVENT_BATCH_MAX_SIZE` events
+    """
+
+    def __init__(self, window: float, publish: t.Callable[[t.List[t.Any]], t.Any]):
+        self.window = window
+        self.publish = publish
+        self._events: t.List[t.Any] = []
+        self._timer: t.Optional[Timer] = None
+        self._lock = Lock()
+
+    def add(self, event: t.Any):
+        with self._lock:
+            self._events.append(event)
+            if len(self._events) >= EVENT_BATCH_MAX_SIZE:
+                full = True
+            else:
+                full = False
+                if self._timer is None:
+                    self._timer = Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if events:
+            self.publish(events)
@@ -86,10 +86,9 @@ class Entity:
         | `<object_id>`          | The ID of the device. This is only to allow for separate topics for each device and is not used for the entity_id. The ID of the device must only consist of characters from the character class `[a-zA-Z0-9_-]` (alphanumerics, underscore and hyphen). |
         """
 
-        node_id = f"{APP_NAME}-{self.device.slug}-{self.device.serial_no}"
         object_id = self.name_slug
 
-        return f"{prefix}/{self.component}/{node_id}/{object_id}/config"
+        return f"{prefix}/{self.component}/{self.device.ha_node_id}/{object_id}/config"
 
     def absolute_topic(self, topic: str):
         if topic.startswith("~"):
@@ -107,30 +106,29 @@ class Entity:
 
     def setup_ha(self, api: "Amcrest2MQTT"):
         """
-        Register publish callback, publish discovery to Home Assistant, then subscribe to command topics
+        Register the publish callback for Home Assistant
+
+        Discovery config is published and command topics are subscribed to by the
+        `DiscoveryManager`, for all entities at once
         """
 
         callback = partial(self._publish_mqtt, api)
         self.register_publish_callback(callback)
 
-        api.mqtt_publish(
-            self.get_ha_config_topic(api.home_assistant_prefix),
-            {
-                "~": self.base_topic,
-                "availability_topic": self.device.status_topic,
-                "device": self.device.as_mqtt_device_dict(),
-                "name": self.friendly_name,
-                "state_topic": "~",
-                "unique_id": self.unique_id,
-                "qos": api.mqtt_qos,
-                **self.extra_config,
-            },
-            json=True,
-        )
-
-        for topic in self.command_topics.values():
-            logger.info(f'Subscribing to command topic "{topic}" for entity "{self.name}"')
-            api.mqtt_client.subscribe(topic)
+    def get_ha_config(self, api: "Amcrest2MQTT") -> dict:
+        """
+        https://www.home-assistant.io/docs/mqtt/discovery/#discovery-payload
+        """
+        return {
+            "~": self.base_topic,
+            "availability_topic": self.device.status_topic,
+            "device": self.device.as_mqtt_device_dict(),
+            "name": self.friendly_name,
+            "state_topic": "~",
+            "unique_id": self.unique_id,
+            "qos": api.mqtt_qos,
+            **self.extra_config,
+        }
 
     def _publish_mqtt(self, api: "Amcrest2MQTT", payload: t.Any, topic: str = None):
         """
@@ -165,82 +163,6 @@ class Entity:
             if cb(payload, topic) is False:
                 break
 
-    DEF_DOORBELL = {
-        "name": "Doorbell",
-        "component": COMPONENT_BINARY_SENSOR,
-        "icon": ICON_RADIOBOX_MARKED,
-    }
-    DEF_HUMAN = {
-        "name": "Human",
-        "component": COMPONENT_BINARY_SENSOR,
-        "device_class": DEVICE_CLASS_MOTION,
-        "icon": ICON_FACE_RECOGNITION,
-    }
-    DEF_FLASHLIGHT = {
-        "name": "Flashlight",
-        "component": COMPONENT_LIGHT,
-        "command_topics": {
-            "command": "~/set",
-            "effect_command": "~/set_effect",
-        },
-        "effect_state_topic": "~/effect",
-        "effect_list": [LIGHT_EFFECT_NONE, LIGHT_EFFECT_STROBE],
-        "icon": ICON_FLASHLIGHT,
-    }
-    DEF_MOTION = {
-        "name": "Motion",
-        "component": COMPONENT_BINARY_SENSOR,
-        "device_class": DEVICE_CLASS_MOTION,
-    }
-    DEF_STORAGE_USED_PERCENT = {
-        "name": "Storage Used Percent",
-        "component": COMPONENT_SENSOR,
-        "friendly_name": "Storage Used %",
-        "icon": ICON_MICRO_SD,
-        "unit_of_measurement": UNITS_PERCENTAGE,
-        "entity_category": ENTITY_CATEGORY_DIAGNOSTIC,
-    }
-    DEF_STORAGE_USED = {
-        "name": "Storage Used",
-        "component": COMPONENT_SENSOR,
-        "icon": ICON_MICRO_SD,
-        "unit_of_measurement": UNITS_GIGABYTES,
-        "entity_category": ENTITY_CATEGORY_DIAGNOSTIC,
-    }
-    DEF_STORAGE_TOTAL = {
-        "name": "Storage Total",
-        "component": COMPONENT_SENSOR,
-        "icon": ICON_MICRO_SD,
-        "unit_of_measurement": UNITS_GIGABYTES,
-        "entity_category": ENTITY_CATEGORY_DIAGNOSTIC,
-    }
-    DEF_SIREN_VOLUME = {
-        "name": "Siren Volume",
-        "component": COMPONENT_NUMBER,
-        "icon": ICON_VOLUME_HIGH,
-        "command_topics": {"command": "~/set"},
-        "entity_category": ENTITY_CATEGORY_CONFIG,
-        "min": 0,
-        "max": 100,
-        "step": 1,
-    }
-    DEF_WATERMARK = {
-        "name": "Watermark",
-        "component": COMPONENT_SWITCH,
-        "icon": ICON_WATERMARK,
-        "command_topics": {"command": "~/set"},
-        "entity_category": ENTITY_CATEGORY_CONFIG,
-    }
-    DEF_INDICATOR_LIGHT = {
-        "name": "Indicator Light",
-        "component": COMPONENT_LIGHT,
-        "icon": ICON_CIRCLE_OUTLINE,
-        "command_topics": {
-            "command": "~/set",
-        },
-        "entity_category": ENTITY_CATEGORY_CONFIG,
-    }
-
 
 class PublishCallback(t.Protocol):
     def __call__(self, payload: t.Any, topic: t.Optional[str] = None) -> t.Any:
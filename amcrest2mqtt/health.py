@@ -0,0 +1,174 @@
+from __future__ import annotations
+import logging
+import typing as t
+
+from .camera import Camera, AmcrestError
+from .const import *
+from .entity import Entity
+from .util import str2bool
+
+
+__all__ = ["Health", "HealthPoller"]
+
+
+logger = logging.getLogger(__name__)
+
+
+RECORD_MODES = {"0": "Auto", "1": "Manual", "2": "Off"}
+
+
+class Health(t.NamedTuple):
+    """Diagnostics read from the camera; `None` when the camera didn't report a value"""
+
+    storage_used_percent: t.Optional[float] = None
+    storage_used: t.Optional[float] = None  # GB
+    storage_total: t.Optional[float] = None  # GB
+    storage_problem: t.Optional[bool] = None
+    recording_mode: t.Optional[str] = None
+    uptime: t.Optional[int] = None  # Seconds
+    wifi_signal: t.Optional[int] = None  # Percentage
+
+
+class HealthQuery(t.NamedTuple):
+    cmd: str
+    parse: t.Callable[[t.Dict[str, str]], t.Dict[str, t.Any]]
+    # `Health` fields the query reports
+    fields: t.Tuple[str, ...]
+    # Optional queries are dropped once the camera shows it doesn't support them, as not every
+    # model does, and their entities aren't created
+    optional: bool = False
+
+
+def _parse_storage(table: t.Dict[str, str]) -> t.Dict[str, t.Any]:
+    used = total = 0.0
+    problem = False
+    found = False
+    for key, value in table.items():
+        if key.endswith(".UsedBytes"):
+            used += float(value)
+            found = True
+        elif key.endswith(".TotalBytes"):
+            total += float(value)
+            found = True
+        elif key.endswith(".IsError"):
+            problem = problem or str2bool(value)
+        elif key.endswith(".State"):
+            problem = problem or value not in ("Success", "Normal")
+
+    if not found:
+        return {}
+
+    return {
+        "storage_used_percent": round(100 * used / total, 2) if total else None,
+        "storage_used": round(used / 1024**3, 2),
+        "storage_total": round(total / 1024**3, 2),
+        "storage_problem": problem,
+    }
+
+
+def _parse_record_mode(table: t.Dict[str, str]) -> t.Dict[str, t.Any]:
+    mode = table.get("table.RecordMode[0].Mode")
+    return {"recording_mode": RECORD_MODES.get(mode, mode)}
+
+
+def _parse_uptime(table: t.Dict[str, str]) -> t.Dict[str, t.Any]:
+    uptime = table.get("up")
+    return {"uptime": int(uptime) if uptime else None}
+
+
+def _parse_wifi(table: t.Dict[str, str]) -> t.Dict[str, t.Any]:
+    for key, value in table.items():
+        if key.endswith((".LinkQuality", ".SignalQuality", ".RSSIQuality")):
+            return {"wifi_signal": int(value)}
+    return {}
+
+
+HEALTH_QUERIES = (
+    # Storage usage and SD card state for every storage device
+    HealthQuery(
+        "storageDevice.cgi?action=getDeviceAllInfo",
+        _parse_storage,
+        ("storage_used_percent", "storage_used", "storage_total", "storage_problem"),
+    ),
+    HealthQuery(
+        "configManager.cgi?action=getConfig&name=RecordMode",
+        _parse_record_mode,
+        ("recording_mode",),
+    ),
+    HealthQuery("magicBox.cgi?action=getUpTime", _parse_uptime, ("uptime",), optional=True),
+    HealthQuery(
+        "configManager.cgi?action=getConfig&name=WLan",
+        _parse_wifi,
+        ("wifi_signal",),
+        optional=True,
+    ),
+)
+
+
+def _is_unsupported(error: AmcrestError) -> bool:
+    """Whether the camera rejected a request (HTTP 4xx), rather than failing to answer it"""
+    response = getattr(error.__cause__, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and 400 <= status < 500
+
+
+class HealthPoller:
+    """
+    Reads storage, SD card, recording, uptime and Wi-Fi diagnostics from the camera
+
+    Each query returns several diagnostics at once, and optional queries a model doesn't support
+    are dropped once the camera rejects them or answers without the values. Values are only
+    published when they've changed.
+    """
+
+    def __init__(self, camera: Camera, entities: t.Dict[str, Entity]):
+        self.camera = camera
+        self.entities = entities
+        self._queries = list(HEALTH_QUERIES)
+        self._published: t.Dict[str, t.Any] = {}
+        # The last fetched health, kept up to date on standby too
+        self.latest: t.Optional[Health] = None
+
+    def fetch(self) -> Health:
+        values = {}
+        for query in list(self._queries):
+            try:
+                parsed = query.parse(self.camera.get_table(query.cmd))
+            except AmcrestError as error:
+                if query.optional and _is_unsupported(error):
+                    self._drop(query)
+                else:
+                    logger.warning(f'Error fetching health information "{query.cmd}": {error}')
+                continue
+            except ValueError as error:
+                logger.warning(f'Invalid health information "{query.cmd}": {error}')
+                continue
+
+            if query.optional and all(value is None for value in parsed.values()):
+                self._drop(query)
+            values.update(parsed)
+        self.latest = Health(**values)
+        return self.latest
+
+    def _drop(self, query: HealthQuery):
+        logger.info(f'Camera does not support "{query.cmd}", skipping from now on')
+        self._queries.remove(query)
+
+    def supported_entities(self) -> t.List[Entity]:
+        """
+        Entities of every query not dropped as unsupported, including those that failed (e.g. while
+        the camera boots), as leaving them out would delete them from Home Assistant
+        """
+        fields = {field for query in self._queries for field in query.fields}
+        return [entity for field, entity in self.entities.items() if field in fields]
+
+    def publish(self, health: Health, force: bool = False):
+        for field, entity in self.entities.items():
+            value = getattr(health, field)
+            if value is None or (not force and self._published.get(field) == value):
+                continue
+            if isinstance(value, bool):
+                entity.publish(PAYLOAD_ON if value else PAYLOAD_OFF)
+            else:
+                entity.publish(value)
+            self._published[field] = value
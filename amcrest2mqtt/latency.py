@@ -0,0 +1,119 @@
+from __future__ import annotations
+import math
+from threading import Lock
+import time
+import typing as t
+
+from .const import *
+
+
+__all__ = ["LatencyHistogram", "LatencyTracker"]
+
+
+class LatencyHistogram:
+    """
+    Rolling histogram of latencies, in fixed memory
+
+    Latencies fall into logarithmic buckets (each `LATENCY_BUCKET_GROWTH` times wider than the
+    previous one, from `LATENCY_BUCKET_MIN` milliseconds), so percentiles are accurate to within
+    one bucket width at any scale. Counts are kept per time slot, and only the last `slots`
+    slots of `slot_duration` seconds count towards percentiles.
+    """
+
+    def __init__(
+        self,
+        slots: int = LATENCY_WINDOW_SLOTS,
+        slot_duration: float = LATENCY_SLOT_DURATION,
+        buckets: int = LATENCY_BUCKETS,
+    ):
+        self.slot_duration = slot_duration
+        self._counts = [[0] * buckets for _ in range(slots)]
+        self._epochs = [-1] * slots
+        self._lock = Lock()
+
+    @staticmethod
+    def bucket_bound(bucket: int) -> float:
+        """Upper bound of a bucket, in milliseconds"""
+        return LATENCY_BUCKET_MIN * LATENCY_BUCKET_GROWTH**bucket
+
+    def record(self, latency: float):
+        """Record a latency, in milliseconds"""
+        bucket = 0
+        if latency > LATENCY_BUCKET_MIN:
+            bucket = math.ceil(math.log(latency / LATENCY_BUCKET_MIN, LATENCY_BUCKET_GROWTH))
+        with self._lock:
+            counts = self._slot(int(time.monotonic() // self.slot_duration))
+            counts[min(bucket, len(counts) - 1)] += 1
+
+    def percentiles(self, *percents: float) -> t.Tuple[t.Optional[float], ...]:
+        """
+        Latencies (in milliseconds, as bucket upper bounds) below which the given percentages of
+        recorded latencies fall; `None` if nothing was recorded within the window
+        """
+        with self._lock:
+            epoch = int(time.monotonic() // self.slot_duration)
+            totals = [0] * len(self._counts[0])
+            for slot, counts in zip(self._epochs, self._counts):
+                if epoch - len(self._epochs) < slot <= epoch:
+                    totals = [total + count for total, count in zip(totals, counts)]
+
+        count = sum(totals)
+        if not count:
+            return tuple(None for _ in percents)
+
+        results = []
+        for percent in percents:
+            rank = percent / 100 * count
+            seen = 0
+            for bucket, bucket_count in enumerate(totals):
+                seen += bucket_count
+                if seen >= rank:
+                    break
+            results.append(round(self.bucket_bound(bucket), 1))
+        return tuple(results)
+
+    def count(self) -> int:
+        with self._lock:
+            epoch = int(time.monotonic() // self.slot_duration)
+            return sum(
+                sum(counts)
+                for slot, counts in zip(self._epochs, self._counts)
+                if epoch - len(self._epochs) < slot <= epoch
+            )
+
+    def _slot(self, epoch: int) -> t.List[int]:
+        index = epoch % len(self._epochs)
+        counts = self._counts[index]
+        if self._epochs[index] != epoch:
+            counts[:] = [0] * len(counts)
+            self._epochs[index] = epoch
+        return counts
+
+
+class LatencyTracker:
+    """
+    Event-to-state latency, from receiving an event from the camera to the broker acknowledging
+    the resulting publish, per entity and overall
+    """
+
+    def __init__(self):
+        self.overall = LatencyHistogram()
+        # By entity name slug; bounded by the device's entities
+        self.entities: t.Dict[str, LatencyHistogram] = {}
+
+    def record(self, name_slug: str, received_at: float):
+        """Record the latency of a publish for an event received at `received_at` (monotonic)"""
+        latency = (time.monotonic() - received_at) * 1000
+        histogram = self.entities.get(name_slug)
+        if histogram is None:
+            histogram = self.entities.setdefault(name_slug, LatencyHistogram())
+        histogram.record(latency)
+        self.overall.record(latency)
+
+    def summary(self) -> t.Dict[str, t.Dict[str, t.Any]]:
+        """Percentiles and counts per entity, within the rolling window"""
+        summary = {}
+        for name_slug, histogram in sorted(self.entities.items()):
+            p50, p95, p99 = histogram.percentiles(50, 95, 99)
+            summary[name_slug] = {"p50": p50, "p95": p95, "p99": p99, "count": histogram.count()}
+        return summary
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import json
+import logging
+from queue import Queue
+import random
+from threading import Event, Lock, Thread
+import time
+import typing as t
+
+from .const import *
+from .mqtt_client import MQTTClient, MQTTMessage, MQTTPublishError
+
+
+__all__ = ["LeaderElection"]
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """
+    Elects one of several instances serving the same device, through a retained lease topic
+
+    The leader publishes a heartbeat to the lease topic every `ttl / LEADER_HEARTBEATS_PER_TTL`
+    seconds. Standbys claim the lease once no heartbeat has been seen for `ttl` seconds, or as
+    soon as the leader releases it by clearing the topic. Lease expiry is measured with each
+    instance's own monotonic clock, so instances don't need synchronized clocks.
+
+    A free lease is only claimed after a heartbeat interval (giving a retained lease time to
+    arrive) plus a random delay of up to another one, so instances starting together, or standbys
+    seeing the lease released, don't all claim it at once. If two instances still claim the lease
+    at the same time, the one with the lowest identity keeps it.
+
+    `on_elected` and `on_demoted` are called in order from a thread of their own, never from the
+    MQTT network thread, so they may block (e.g. on publishes or camera requests) without
+    delaying heartbeats. `wait_elected()` returns once `on_elected` has completed.
+    """
+
+    def __init__(
+        self,
+        mqtt_client: MQTTClient,
+        topic: str,
+        identity: str,
+        *,
+        ttl: float = DEFAULT_HA_LEASE_TTL,
+        on_elected: t.Callable[[], t.Any],
+        on_demoted: t.Callable[[], t.Any],
+    ):
+        self.mqtt_client = mqtt_client
+        self.topic = topic
+        self.identity = identity
+        self.ttl = ttl
+        self.heartbeat_interval = ttl / LEADER_HEARTBEATS_PER_TTL
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+
+        self._lock = Lock()
+        self._jitter = random.uniform(0, self.heartbeat_interval)
+        self._holder: t.Optional[str] = None
+        self._last_seen = 0.0
+        self._is_leader = False
+        self._step_down = False
+        self._released = False
+        self._elected = Event()
+        self._wakeup = Event()
+        # Leadership changes for the callback thread to act on
+        self._transitions: "Queue[bool]" = Queue()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def wait_elected(self, timeout: t.Optional[float] = None) -> bool:
+        return self._elected.wait(timeout)
+
+    def start(self):
+        self._last_seen = time.monotonic()  # Give a retained lease time to arrive before claiming
+        self.mqtt_client.message_callback_add(self.topic, self._on_lease_message)
+        self.mqtt_client.subscribe(self.topic, qos=self.mqtt_client.qos)
+        Thread(target=self._run, name="leader-election", daemon=True).start()
+        Thread(target=self._run_callbacks, name="leader-callbacks", daemon=True).start()
+
+    def release(self):
+        """
+        Hand over the lease immediately and stop taking part in the election, e.g. when exiting
+        """
+        self._released = True
+        self._wakeup.set()
+        if self._is_leader:
+            self._set_leader(False)
+            # Otherwise the lease simply expires
+            if self.mqtt_client.is_connected():
+                try:
+                    self.mqtt_client.publish(self.topic, "")
+                except MQTTPublishError as error:
+                    logger.warning(f"Could not release the lease: {error}")
+
+    def _run(self):
+        while not self._released:
+            with self._lock:
+                step_down, self._step_down = self._step_down, False
+                expires_in = self._last_seen + self._jitter - time.monotonic()
+                expires_in += self.heartbeat_interval if self._holder is None else self.ttl
+                expired = expires_in <= 0
+
+            if self._released:
+                break
+            elif step_down and self._is_leader:
+                logger.warning(f'Lost leadership to "{self._holder}"')
+                self._set_leader(False)
+            elif self._is_leader:
+                self._heartbeat()
+            elif expired:
+                logger.info(f"Lease {'expired' if self._holder else 'free'}, taking over")
+                self._heartbeat()
+                self._set_leader(True)
+
+            timeout = self.heartbeat_interval
+            if not self._is_leader and not expired:
+                timeout = min(timeout, expires_in)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _heartbeat(self):
+        self.mqtt_client.publish(
+            self.topic, {"holder": self.identity, "ttl": self.ttl}, json=True, wait=False
+        )
+
+    def _set_leader(self, is_leader: bool):
+        if is_leader == self._is_leader:
+            return
+        self._is_leader = is_leader
+        if is_leader:
+            logger.info("Elected leader")
+        else:
+            logger.info("Now on standby")
+            self._elected.clear()
+        self._transitions.put(is_leader)
+
+    def _run_callbacks(self):
+        while True:
+            is_leader = self._transitions.get()
+            try:
+                if is_leader:
+                    self.on_elected()
+                else:
+                    self.on_demoted()
+            except Exception as exc:
+                logger.exception(exc)
+            # Only once activated, and unless demoted in the meantime
+            if is_leader and self._is_leader:
+                self._elected.set()
+
+    def _on_lease_message(self, client, userdata, message: MQTTMessage):
+        with self._lock:
+            if not message.payload:
+                # Released by the leader, claim it after the random delay
+                self._holder = None
+                self._last_seen = time.monotonic() - self.heartbeat_interval
+                self._wakeup.set()
+                return
+
+            try:
+                holder = json.loads(message.payload)["holder"]
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f'Ignoring malformed lease "{message.payload!r}"')
+                return
+
+            if holder == self.identity:
+                return
+
+            self._holder = holder
+            self._last_seen = time.monotonic()
+            if self._is_leader and holder < self.identity:
+                self._step_down = True
+                self._wakeup.set()
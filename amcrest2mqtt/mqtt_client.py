@@ -1,13 +1,26 @@
 import logging, ssl
 from json import dumps
+from threading import Event, Lock
 import typing as t
 
-from paho.mqtt.client import Client, MQTTMessage, MQTT_ERR_SUCCESS, error_string
+from paho.mqtt.client import (
+    Client,
+    MQTTMessage,
+    MQTTMessageInfo,
+    MQTTv311,
+    MQTTv5,
+    MQTT_ERR_SUCCESS,
+    error_string,
+)
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.reasoncodes import ReasonCodes
 
 from .const import *
 from .device import Device
+from .diagnostics import StageTracer
 
-__all__ = ["MQTTClient", "MQTTMessage", "MQTTPublishError"]
+__all__ = ["MQTTClient", "MQTTMessage", "MQTTMessageInfo", "MQTTPublishError", "MQTTSubscribeError"]
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +30,10 @@ class MQTTPublishError(Exception):
     pass
 
 
+class MQTTSubscribeError(Exception):
+    pass
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -31,15 +48,57 @@ class MQTTClient:
         tls_cert: t.Optional[str] = None,
         tls_key: t.Optional[str] = None,
         device: Device,
+        protocol: str = DEFAULT_MQTT_PROTOCOL,
+        tracer: t.Optional[StageTracer] = None,
     ):
         self.device = device
+        self.tracer = tracer or StageTracer()
         self.client_suffix = client_suffix
         self.qos = qos
-        self.client = Client(client_id=self.client_id, clean_session=False)
-        self.client.will_set(device.status_topic, payload=PAYLOAD_OFFLINE, qos=qos, retain=True)
+        self._on_disconnect = None
+        self._connack = Event()
+        self._connack_reason: t.Optional[int] = None
+        self._protocol = MQTTv311
+
+        # MQTT v5 topic aliases by topic, of which the broker accepts up to `_topic_alias_maximum`
+        self._topic_aliases: t.Dict[str, int] = {}
+        self._topic_aliases_sent: t.Set[str] = set()
+        self._topic_alias_maximum = 0
+        self._topic_aliases_lock = Lock()
+
+        connect_args = (host, port, username, password, tls_ca_cert, tls_cert, tls_key)
+        self.client = self._connect(
+            MQTTv5 if protocol == MQTT_PROTOCOL_V5 else MQTTv311, *connect_args
+        )
+        if self._connack_reason == MQTT_REASON_UNSUPPORTED_PROTOCOL_VERSION:
+            logger.warning("MQTT broker doesn't support MQTT v5, falling back to v3.1.1")
+            self.client.loop_stop()
+            self.client = self._connect(MQTTv311, *connect_args)
+
+    def _connect(
+        self,
+        protocol: int,
+        host: str,
+        port: int,
+        username: str,
+        password: t.Optional[str],
+        tls_ca_cert: t.Optional[str],
+        tls_cert: t.Optional[str],
+        tls_key: t.Optional[str],
+    ) -> Client:
+        self._protocol = protocol
+        if protocol == MQTTv5:
+            client = Client(client_id=self.client_id, protocol=MQTTv5)
+        else:
+            client = Client(client_id=self.client_id, clean_session=False)
+        client.will_set(
+            self.device.status_topic, payload=PAYLOAD_OFFLINE, qos=self.qos, retain=True
+        )
+        client.on_connect = self._handle_connect
+        client.on_disconnect = self._handle_disconnect
 
         if tls_ca_cert or tls_cert or tls_key:
-            self.client.tls_set(
+            client.tls_set(
                 ca_certs=tls_ca_cert,
                 certfile=tls_cert,
                 keyfile=tls_key,
@@ -47,10 +106,22 @@ class MQTTClient:
                 tls_version=ssl.PROTOCOL_TLS,
             )
         else:
-            self.client.username_pw_set(username=username, password=password)
+            client.username_pw_set(username=username, password=password)
 
-        self.client.connect(host, port=port)
-        self.client.loop_start()
+        if protocol == MQTTv5:
+            # Keep the session (and its subscriptions) across reconnects, like `clean_session=False`
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY_NEVER
+            self._connack.clear()
+            client.connect(host, port=port, clean_start=False, properties=properties)
+            client.loop_start()
+            # Wait for the CONNACK to know whether the broker supports MQTT v5
+            if not self._connack.wait(TIME_MQTT_CONNACK_TIMEOUT):
+                logger.warning("Timed out waiting for the MQTT broker to accept the connection")
+        else:
+            client.connect(host, port=port)
+            client.loop_start()
+        return client
 
     def __getattr__(self, attr):
         return getattr(self.client, attr)
@@ -62,6 +133,10 @@ class MQTTClient:
             id_ = f"{id_}_{self.client_suffix}"
         return id_
 
+    @property
+    def is_v5(self) -> bool:
+        return self._protocol == MQTTv5
+
     @property
     def on_message(self):
         return self.client.on_message
@@ -72,27 +147,121 @@ class MQTTClient:
 
     @property
     def on_disconnect(self):
-        return self.client.on_disconnect
+        return self._on_disconnect
 
     @on_disconnect.setter
     def on_disconnect(self, on_disconnect):
-        self.client.on_disconnect = on_disconnect
+        # Always called as `on_disconnect(client, userdata, rc)`, whatever the protocol version
+        self._on_disconnect = on_disconnect
 
-    def publish(self, topic: str, payload: t.Any, json=False) -> MQTTMessage:
-        msg = self.client.publish(
-            topic, self.transform_payload(payload, json), qos=self.qos, retain=True
-        )
+    def _handle_connect(self, client, userdata, flags, rc, properties=None):
+        with self._topic_aliases_lock:
+            # Aliases only last as long as a connection
+            self._topic_aliases_sent.clear()
+            self._topic_alias_maximum = getattr(properties, "TopicAliasMaximum", 0)
+        self._connack_reason = rc.value if isinstance(rc, ReasonCodes) else rc
+        self._connack.set()
+
+    def _handle_disconnect(self, client, userdata, rc, properties=None):
+        # MQTT v5 clients are called with a reason code and properties
+        if isinstance(rc, ReasonCodes):
+            rc = rc.value
+        if self._on_disconnect is not None and client is self.__dict__.get("client"):
+            self._on_disconnect(client, userdata, rc)
+
+    def register_topic_alias(self, topic: str):
+        """
+        Publish to `topic` through a topic alias with MQTT v5, so the topic is only sent in full
+        once per connection; meant for frequently published topics, as brokers limit the number of
+        aliases
+
+        Only used with QoS 0: messages still in flight are resent as they were after a reconnect,
+        when the aliases they use are no longer set
+        """
+        with self._topic_aliases_lock:
+            self._topic_aliases.setdefault(topic, len(self._topic_aliases) + 1)
+
+    def publish(
+        self,
+        topic: str,
+        payload: t.Any,
+        json=False,
+        wait=True,
+        *,
+        expiry: t.Optional[int] = None,
+        user_properties: t.Optional[t.Dict[str, str]] = None,
+    ) -> MQTTMessageInfo:
+        """
+        Publish a retained message
+
+        With `wait=False` the message is handed to the network loop and returned immediately, so
+        several messages can be pipelined and waited on afterwards with `wait_for_publish()`
+
+        With MQTT v5, the broker drops the message after `expiry` seconds, and `user_properties`
+        are sent along with it; both are ignored with MQTT v3.1.1
+        """
+        with self.tracer.stage("serialize"):
+            payload = self.transform_payload(payload, json)
+
+        if self.is_v5:
+            msg = self._publish_v5(topic, payload, expiry, user_properties)
+        else:
+            msg = self.client.publish(topic, payload, qos=self.qos, retain=True)
 
         if msg.rc == MQTT_ERR_SUCCESS:
-            msg.wait_for_publish()
+            if wait:
+                with self.tracer.stage("ack"):
+                    msg.wait_for_publish()
             return msg
 
         raise MQTTPublishError(f"Error publishing MQTT message: {error_string(msg.rc)}")
 
+    def _publish_v5(
+        self,
+        topic: str,
+        payload: t.Union[str, bytes],
+        expiry: t.Optional[int],
+        user_properties: t.Optional[t.Dict[str, str]],
+    ) -> MQTTMessageInfo:
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry:
+            properties.MessageExpiryInterval = expiry
+        if user_properties:
+            properties.UserProperty = list(user_properties.items())
+
+        alias = self._topic_aliases.get(topic)
+        if alias is None or self.qos > 0:
+            return self.client.publish(
+                topic, payload, qos=self.qos, retain=True, properties=properties
+            )
+
+        # Held while publishing, so the message setting an alias is queued before those using it
+        with self._topic_aliases_lock:
+            if alias <= self._topic_alias_maximum:
+                properties.TopicAlias = alias
+                if topic in self._topic_aliases_sent:
+                    topic = ""
+                else:
+                    self._topic_aliases_sent.add(topic)
+            return self.client.publish(
+                topic, payload, qos=self.qos, retain=True, properties=properties
+            )
+
+    def subscribe_many(self, topics: t.Iterable[str]):
+        """
+        Subscribe to several topics with a single SUBSCRIBE packet
+        """
+        topics = [(topic, self.qos) for topic in topics]
+        if not topics:
+            return
+        rc, _ = self.client.subscribe(topics)
+        if rc != MQTT_ERR_SUCCESS:
+            raise MQTTSubscribeError(f"Error subscribing to MQTT topics: {error_string(rc)}")
+
     @staticmethod
-    def transform_payload(payload: t.Any, json: bool) -> str:
+    def transform_payload(payload: t.Any, json: bool) -> t.Union[str, bytes]:
         if json:
             return dumps(payload)
-        if isinstance(payload, bytes):
-            return payload.decode()
+        if isinstance(payload, (bytes, bytearray)):
+            return payload  # Binary payloads (e.g. snapshots) are published as-is
         return str(payload)
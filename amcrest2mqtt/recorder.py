@@ -0,0 +1,138 @@
+from __future__ import annotations
+import gzip
+import json
+import logging
+from threading import Lock
+import time
+import typing as t
+import zlib
+
+from .camera import AmcrestError
+from .const import *
+from .device import Device
+
+
+__all__ = ["EventRecorder", "ReplayCamera"]
+
+
+logger = logging.getLogger(__name__)
+
+
+# Recordings are gzipped JSON lines. Each recording session appends a gzip member starting with a
+# header line, `{"device": {...}, "started_at": <unix time>}`, followed by one line per event,
+# `[<seconds since the session started>, <code>, <payload>]`. Offsets use a monotonic clock.
+#
+# Members are written without a file name or timestamp, so they all start with the same header.
+# This lets the reader find every member even after one was left unterminated by a crash, which
+# `gzip.open()` can't read past.
+MEMBER_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+
+
+class EventRecorder:
+    """
+    Appends every raw event read from the camera to a recording, for replaying later
+
+    Each event is flushed straight away, so a recording survives the app crashing
+    """
+
+    def __init__(self, path: str, device: Device):
+        self.path = path
+        self._lock = Lock()
+        self._raw = open(path, "ab")
+        self._file = gzip.GzipFile(filename="", mode="ab", fileobj=self._raw, mtime=0)
+        self._started = time.monotonic()
+        self._write({"device": device._asdict(), "started_at": time.time()})
+
+    def record(self, code: str, payload: t.Any):
+        self._write([round(time.monotonic() - self._started, 6), code, payload])
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._raw.close()
+
+    def _write(self, obj: t.Any):
+        line = json.dumps(obj, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line.encode() + b"\n")
+            self._file.flush()  # Also flushes the compressor, so every event is readable
+
+
+class ReplayCamera:
+    """
+    Stands in for `Camera`, reading the device and events from a recording instead
+
+    With a `speed` of 1 events are replayed at the pace they were recorded, 2 twice as fast, etc.;
+    0 replays them as fast as possible. Only the first device of a recording is used, and any
+    command that would need a real camera raises `AmcrestError`.
+    """
+
+    def __init__(self, path: str, speed: float = DEFAULT_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+
+    def get_device(self) -> Device:
+        for line in self._lines():
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                return Device(**obj["device"])
+        raise AmcrestError(f'No device in recording "{self.path}"')
+
+    def events(self) -> t.Iterator[t.Tuple[str, dict]]:
+        replay_started: t.Optional[float] = None
+        session_offset = 0.0  # Offset of the current session within the replay
+        last_offset = 0.0
+        count = 0
+
+        for line in self._lines():
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                # A new session continues where the previous one stopped
+                session_offset = last_offset
+                continue
+
+            offset, code, payload = obj
+            last_offset = session_offset + offset
+            if replay_started is None:
+                replay_started = time.monotonic() - last_offset / self.speed if self.speed else 0
+            if self.speed:
+                delay = replay_started + last_offset / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            count += 1
+            yield code, payload
+
+        logger.info(f'Replayed {count} event(s) from "{self.path}"')
+
+    def _lines(self) -> t.Iterator[str]:
+        with open(self.path, "rb") as file:
+            data = file.read()
+
+        for member in data.split(MEMBER_HEADER)[1:]:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                text = decompressor.decompress(member).decode("utf-8", errors="replace")
+            except zlib.error as error:
+                logger.warning(f'Skipping corrupt session in recording "{self.path}": {error}')
+                continue
+            if not decompressor.eof:
+                logger.info(f'Recording "{self.path}" has an unterminated session')
+
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    json.loads(line)
+                except ValueError:
+                    continue  # Cut short by a crash
+                yield line
+
+    def set_credentials(self, username: str, password: str):
+        pass
+
+    def _unavailable(self, *args, **kwargs):
+        raise AmcrestError("Not available when replaying a recording")
+
+    get_config = get_configs = get_config_all = get_table = _unavailable
+    set_config = snapshot_into = _unavailable
@@ -0,0 +1,255 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import typing as t
+
+from .const import *
+from .device import Device
+from .entity import Entity
+from .util import clamp, str2bool
+
+
+__all__ = [
+    "CommandAction",
+    "CommandDefinition",
+    "EntityDefinition",
+    "EntityRegistry",
+    "EntityTable",
+    "StateDefinition",
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+ENTITY_REGISTRY_PATH = os.path.join(os.path.dirname(__file__), "entities.json")
+
+TYPES: t.Dict[str, t.Callable[[str], t.Any]] = {
+    "bool": str2bool,
+    "float": float,
+    "int": int,
+    "str": str,
+}
+
+
+def _check_dict(value: t.Any, where: str) -> t.Dict[str, t.Any]:
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected an object for {where}, got {value!r}")
+    return value
+
+
+def _check_type(type: str, where: str):
+    if type not in TYPES:
+        raise ValueError(f'Unknown type "{type}" in {where}, expected one of {sorted(TYPES)}')
+
+
+class StateDefinition(t.NamedTuple):
+    """An entity state read from the camera config table"""
+
+    config_key: str
+    type: str = "str"
+
+    def to_payload(self, raw: str) -> t.Any:
+        value = TYPES[self.type](raw)
+        if isinstance(value, bool):
+            return PAYLOAD_ON if value else PAYLOAD_OFF
+        return value
+
+
+class CommandAction(t.NamedTuple):
+    # Camera config values to set
+    set: t.Dict[str, t.Any]
+    # State to publish once the config values are set, by topic relative to the entity's
+    # `base_topic`
+    state: t.Dict[str, t.Any] = {}
+
+
+class CommandDefinition(t.NamedTuple):
+    """
+    A command topic of an entity
+
+    Either maps each accepted payload to a `CommandAction`, or coerces the payload to `type` and
+    sets it as the entity's state config key
+    """
+
+    topic: str
+    type: t.Optional[str] = None
+    min: t.Optional[float] = None
+    max: t.Optional[float] = None
+    payloads: t.Optional[t.Dict[str, CommandAction]] = None
+
+    def to_value(self, payload: str) -> t.Any:
+        if self.type == "bool":
+            return payload == PAYLOAD_ON
+        value = TYPES[self.type](payload)
+        if self.min is not None or self.max is not None:
+            value = clamp(value, min=self.min, max=self.max)
+        return value
+
+
+class EntityDefinition(t.NamedTuple):
+    name: str
+    component: str
+    friendly_name: t.Optional[str] = None
+    # Device models the entity is created for; all models if `None`
+    models: t.Optional[t.FrozenSet[str]] = None
+    # Only create the entity if this feature is enabled, e.g. `FEATURE_HEALTH`
+    feature: t.Optional[str] = None
+    state: t.Optional[StateDefinition] = None
+    commands: t.Dict[str, CommandDefinition] = {}
+    # Extra Home Assistant discovery config
+    config: t.Dict[str, t.Any] = {}
+
+    @classmethod
+    def from_dict(cls, obj: t.Dict[str, t.Any]) -> "EntityDefinition":
+        name = obj["name"]
+        _check_dict(obj.get("commands", {}), f'commands of entity "{name}"')
+        _check_dict(obj.get("config", {}), f'config of entity "{name}"')
+        unknown = sorted(set(obj) - set(cls._fields))
+        if unknown:
+            raise ValueError(f'Unknown keys in entity "{name}": {unknown}')
+
+        state = None
+        if "state" in obj:
+            state = StateDefinition(**_check_dict(obj["state"], f'state of entity "{name}"'))
+            _check_type(state.type, f'state of entity "{name}"')
+
+        commands = {}
+        for command, command_obj in obj.get("commands", {}).items():
+            where = f'command "{command}" of entity "{name}"'
+            payloads = _check_dict(command_obj, where).get("payloads")
+            if payloads is not None:
+                payloads = {
+                    payload: CommandAction(**_check_dict(action, f'payload "{payload}" of {where}'))
+                    for payload, action in _check_dict(payloads, f"payloads of {where}").items()
+                }
+            definition = CommandDefinition(**{**command_obj, "payloads": payloads})
+            if definition.payloads is None:
+                if definition.type is None:
+                    raise ValueError(f'Either "type" or "payloads" is required in {where}')
+                if state is None:
+                    raise ValueError(f'"type" requires the entity to have a "state" in {where}')
+                _check_type(definition.type, where)
+            commands[command] = definition
+
+        models = obj.get("models")
+
+        return cls(
+            name=name,
+            component=obj["component"],
+            friendly_name=obj.get("friendly_name"),
+            models=frozenset(models) if models is not None else None,
+            feature=obj.get("feature"),
+            state=state,
+            commands=commands,
+            config=obj.get("config", {}),
+        )
+
+    def is_supported(self, device: Device, features: t.AbstractSet[str]) -> bool:
+        if self.models is not None and device.model not in self.models:
+            return False
+        if self.feature is not None and self.feature not in features:
+            return False
+        return True
+
+    def create_entity(self, device: Device) -> Entity:
+        return Entity(
+            device,
+            self.name,
+            self.component,
+            friendly_name=self.friendly_name,
+            command_topics={
+                command: definition.topic for command, definition in self.commands.items()
+            },
+            **self.config,
+        )
+
+
+class EntityRegistry:
+    """
+    Declarative entity definitions, loaded from JSON (or YAML, if PyYAML is installed)
+
+    Raises `ValueError` (or `OSError`, `TypeError` or `KeyError`) if they can't be loaded
+
+    See `entities.json` for the definitions shipped with the app
+    """
+
+    def __init__(self, definitions: t.Iterable[EntityDefinition]):
+        self.definitions = list(definitions)
+
+    @classmethod
+    def load(cls, path: t.Optional[str] = None) -> "EntityRegistry":
+        path = path or ENTITY_REGISTRY_PATH
+        with open(path, encoding="utf-8") as file:
+            if path.endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError(
+                        f'Loading "{path}" requires PyYAML, which is not installed'
+                    ) from None
+
+                try:
+                    objs = yaml.safe_load(file)
+                except yaml.YAMLError as error:
+                    raise ValueError(f'Invalid YAML in "{path}": {error}') from None
+            else:
+                objs = json.load(file)
+        if not isinstance(objs, list):
+            raise ValueError(f'Expected a list of entity definitions in "{path}"')
+        return cls(
+            EntityDefinition.from_dict(_check_dict(obj, "an entity definition")) for obj in objs
+        )
+
+    def compile(self, device: Device, features: t.AbstractSet[str]) -> "EntityTable":
+        return EntityTable(
+            device,
+            [
+                definition
+                for definition in self.definitions
+                if definition.is_supported(device, features)
+            ],
+        )
+
+
+class EntityTable:
+    """
+    The entities of a single device, with lookup tables built once at startup
+    """
+
+    def __init__(self, device: Device, definitions: t.Iterable[EntityDefinition]):
+        # By name slug
+        self.entities: t.Dict[str, Entity] = {}
+        # By name slug
+        self.definitions: t.Dict[str, EntityDefinition] = {}
+        # By absolute command topic
+        self.commands: t.Dict[str, t.Tuple[Entity, EntityDefinition, CommandDefinition]] = {}
+        # By camera config key
+        self.states: t.Dict[str, t.List[t.Tuple[Entity, StateDefinition]]] = {}
+
+        for definition in definitions:
+            entity = definition.create_entity(device)
+            self.entities[entity.name_slug] = entity
+            self.definitions[entity.name_slug] = definition
+            for command, command_definition in definition.commands.items():
+                topic = entity.command_topics[command]
+                self.commands[topic] = (entity, definition, command_definition)
+            if definition.state is not None:
+                self.states.setdefault(definition.state.config_key, []).append(
+                    (entity, definition.state)
+                )
+
+    @property
+    def config_keys(self) -> t.List[str]:
+        """Every camera config key needed to refresh entity states"""
+        return list(self.states)
+
+    def get(self, name_slug: str) -> t.Optional[Entity]:
+        return self.entities.get(name_slug)
+
+    def __contains__(self, name_slug: str) -> bool:
+        return name_slug in self.entities
+
+    def __iter__(self) -> t.Iterator[Entity]:
+        return iter(self.entities.values())
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from collections import Counter
+from datetime import datetime, timezone
+from threading import Lock
+import time
+import typing as t
+
+from .const import *
+
+
+__all__ = ["EventAggregator"]
+
+
+class _Window:
+    def __init__(self, now: float):
+        self.started_at = now  # Monotonic
+        self.started_at_utc = datetime.now(timezone.utc)
+        # By event code, up to ROLLUP_MAX_CODES codes; any others are counted as ROLLUP_OTHER_CODE
+        self.codes: t.Counter[str] = Counter()
+        self.tallies: t.Counter[str] = Counter()
+        self.active_seconds: t.Dict[str, float] = {}
+
+
+class EventAggregator:
+    """
+    Aggregates events into per-window rollups (e.g. per minute and per hour) in constant memory:
+    a count per event code, tallies (e.g. doorbell presses), and how long states were active for
+    (e.g. seconds of motion)
+
+    States active across the end of a window are split between both windows. The given `tallies`
+    and `states` are always part of rollups, even when zero, so consumers get consistent keys.
+    """
+
+    def __init__(
+        self, windows: t.Iterable[str], tallies: t.Iterable[str] = (), states: t.Iterable[str] = ()
+    ):
+        self.tallies = tuple(tallies)
+        self.states = tuple(states)
+        now = time.monotonic()
+        self._windows = {name: _Window(now) for name in windows}
+        # When each currently active state became active, by name
+        self._active_since: t.Dict[str, float] = {}
+        self._lock = Lock()
+
+    def count(self, code: str):
+        with self._lock:
+            for window in self._windows.values():
+                if code in window.codes or len(window.codes) < ROLLUP_MAX_CODES:
+                    window.codes[code] += 1
+                else:
+                    window.codes[ROLLUP_OTHER_CODE] += 1
+
+    def tally(self, name: str):
+        with self._lock:
+            for window in self._windows.values():
+                window.tallies[name] += 1
+
+    def set_active(self, name: str, active: bool):
+        now = time.monotonic()
+        with self._lock:
+            if active:
+                self._active_since.setdefault(name, now)
+                return
+            since = self._active_since.pop(name, None)
+            if since is None:
+                return
+            for window in self._windows.values():
+                window.active_seconds[name] = window.active_seconds.get(name, 0.0) + (
+                    now - max(since, window.started_at)
+                )
+
+    def rollup(self, name: str) -> t.Dict[str, t.Any]:
+        """Summarize a window and start the next one"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows[name]
+            self._windows[name] = _Window(now)
+
+            tallies = {tally: 0 for tally in self.tallies}
+            tallies.update(window.tallies)
+            active_seconds = {state: 0.0 for state in self.states}
+            active_seconds.update(window.active_seconds)
+            for state, since in self._active_since.items():
+                active_seconds[state] = active_seconds.get(state, 0.0) + (
+                    now - max(since, window.started_at)
+                )
+
+        return {
+            "start": window.started_at_utc.isoformat(timespec="seconds"),
+            "end": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "events": sum(window.codes.values()),
+            "codes": dict(window.codes),
+            **tallies,
+            **{f"{state}_seconds": round(seconds, 1) for state, seconds in active_seconds.items()},
+        }
+
+    @staticmethod
+    def until_next(interval: float) -> float:
+        """Seconds until the next multiple of `interval` on the wall clock, e.g. the next minute"""
+        return interval - time.time() % interval
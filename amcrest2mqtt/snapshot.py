@@ -0,0 +1,232 @@
+from __future__ import annotations
+import io
+import logging
+from queue import Queue
+from threading import Event, Lock, Thread
+import time
+import typing as t
+
+from .camera import Camera, AmcrestError, SnapshotTooLargeError
+from .const import *
+from .entity import Entity
+from .util import clamp
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+__all__ = ["BufferPool", "SnapshotPipeline", "SnapshotRingBuffer"]
+
+
+logger = logging.getLogger(__name__)
+
+
+class BufferPool:
+    """
+    A fixed set of preallocated buffers, reused to fetch every snapshot into
+
+    Only the published copy of a frame is allocated per snapshot.
+    """
+
+    def __init__(self, count: int, size: int = SNAPSHOT_BUFFER_SIZE):
+        self.size = size
+        self._free: "Queue[bytearray]" = Queue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def acquire(self, timeout: t.Optional[float] = None) -> bytearray:
+        return self._free.get(timeout=timeout)
+
+    def release(self, buffer: bytearray):
+        self._free.put(buffer)
+
+
+class SnapshotRingBuffer:
+    """
+    Keeps the most recent snapshots in a fixed number of preallocated slots
+
+    Snapshots are only fetched while motion is active (see `set_active()`), at most once every
+    `interval` seconds. The slot being written is never the latest complete one, so there are
+    always at least 2 slots.
+
+    The latest snapshot is only worth publishing while it's recent: within `max_age` seconds,
+    which allows for the interval and a fetch taking as long again.
+    """
+
+    def __init__(self, camera: Camera, size: int, interval: float):
+        self.camera = camera
+        self.interval = interval
+        self.max_age = max(SNAPSHOT_PREBUFFER_MAX_AGE, 2 * interval)
+        size = clamp(size, min=2)
+        self._slots = [bytearray(SNAPSHOT_BUFFER_SIZE) for _ in range(size)]
+        self._lengths = [0] * size
+        self._times = [0.0] * size
+        self._head = 0  # Next slot to write, only touched by the fetch thread
+        self._latest: t.Optional[int] = None
+        self._lock = Lock()
+        self._active = Event()
+        self._stopped = False
+
+    def start(self):
+        Thread(target=self._run, name="snapshot-prebuffer", daemon=True).start()
+
+    def stop(self):
+        self._stopped = True
+        self._active.set()  # Wakes the fetch thread up, so it can exit
+
+    def set_active(self, active: bool):
+        if active:
+            self._active.set()
+        else:
+            self._active.clear()
+
+    def copy_latest_into(self, buffer: bytearray) -> int:
+        """
+        Copy the latest snapshot into `buffer` if it's at most `max_age` seconds old, returning
+        the number of bytes copied (0 if there is no such snapshot)
+        """
+        with self._lock:
+            if self._latest is None or time.monotonic() - self._times[self._latest] > self.max_age:
+                return 0
+            size = self._lengths[self._latest]
+            with memoryview(self._slots[self._latest]) as view:
+                buffer[:size] = view[:size]
+            return size
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            if self._stopped:
+                return
+            started = time.monotonic()
+            slot = self._head
+            try:
+                size = self.camera.snapshot_into(self._slots[slot])
+            except (AmcrestError, SnapshotTooLargeError) as error:
+                logger.debug(f"Error fetching pre-event snapshot: {error}")
+            else:
+                with self._lock:
+                    self._lengths[slot] = size
+                    self._times[slot] = time.monotonic()
+                    self._latest = slot
+                self._head = (slot + 1) % len(self._slots)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+class SnapshotPipeline:
+    """
+    Fetches snapshots on a dedicated camera connection and publishes them to a camera entity
+
+    Snapshots are requested with `trigger()`, which never blocks: fetching, downscaling and
+    publishing happen on a worker thread. Each reason (e.g. "human", "doorbell") is coalesced and
+    rate limited on its own: a trigger is dropped while one for the same reason is pending, or
+    within `min_interval` seconds of the previous snapshot for that reason, so a doorbell press
+    right after a human was detected still gets its snapshot.
+
+    With a `prebuffer`, the most recent buffered snapshot is published as soon as a trigger is
+    handled, followed by a freshly fetched one.
+    """
+
+    def __init__(
+        self,
+        camera: Camera,
+        entity: Entity,
+        *,
+        min_interval: float = DEFAULT_SNAPSHOT_MIN_INTERVAL,
+        max_width: int = DEFAULT_SNAPSHOT_MAX_WIDTH,
+        prebuffer: t.Optional[SnapshotRingBuffer] = None,
+    ):
+        self.camera = camera
+        self.entity = entity
+        self.min_interval = min_interval
+        self.max_width = max_width
+        self.prebuffer = prebuffer
+        self.pool = BufferPool(1)
+        self._requests: "Queue[str]" = Queue()
+        self._pending: t.Set[str] = set()
+        self._pending_lock = Lock()
+        # By reason
+        self._last_snapshot: t.Dict[str, float] = {}
+        self._stopped = False
+        self._scaled = io.BytesIO()
+
+        if self.max_width and Image is None:
+            logger.warning("Snapshot downscaling requires Pillow, which is not installed")
+            self.max_width = 0
+
+    def start(self):
+        if self.prebuffer is not None:
+            self.prebuffer.start()
+        Thread(target=self._run, name="snapshot", daemon=True).start()
+
+    def stop(self):
+        self._stopped = True
+        if self.prebuffer is not None:
+            self.prebuffer.stop()
+        self.trigger("stop")  # Wakes the worker thread up, so it can exit
+
+    def set_motion(self, active: bool):
+        if self.prebuffer is not None:
+            self.prebuffer.set_active(active)
+
+    def trigger(self, reason: str):
+        with self._pending_lock:
+            if reason in self._pending:
+                logger.debug(f"Snapshot already pending, ignoring trigger ({reason})")
+                return
+            self._pending.add(reason)
+        self._requests.put(reason)
+
+    def _run(self):
+        while True:
+            reason = self._requests.get()
+            with self._pending_lock:
+                self._pending.discard(reason)
+            if self._stopped:
+                return
+
+            now = time.monotonic()
+            last = self._last_snapshot.get(reason)
+            if last is not None and now - last < self.min_interval:
+                logger.debug(f"Snapshot rate limited, ignoring trigger ({reason})")
+                continue
+            self._last_snapshot[reason] = now
+
+            buffer = self.pool.acquire()
+            try:
+                if self.prebuffer is not None:
+                    size = self.prebuffer.copy_latest_into(buffer)
+                    if size:
+                        logger.info(f"Publishing pre-event snapshot ({reason})")
+                        self.entity.publish(self._encode(buffer, size))
+
+                logger.info(f"Fetching snapshot ({reason})")
+                size = self.camera.snapshot_into(buffer)
+                self.entity.publish(self._encode(buffer, size))
+            except (AmcrestError, SnapshotTooLargeError) as error:
+                logger.warning(f"Error fetching snapshot: {error}")
+            except Exception as exc:
+                logger.exception(exc)
+            finally:
+                self.pool.release(buffer)
+
+    def _encode(self, buffer: bytearray, size: int) -> bytes:
+        # The one copy of the frame, as the buffer is reused; `BytesIO` shares it rather than
+        # copying it again
+        with memoryview(buffer)[:size] as view:
+            frame = view.tobytes()
+        if not self.max_width:
+            return frame
+
+        image = Image.open(io.BytesIO(frame))
+        if image.width <= self.max_width:
+            return frame
+
+        height = round(image.height * self.max_width / image.width)
+        image = image.resize((self.max_width, height))
+        self._scaled.seek(0)
+        self._scaled.truncate()
+        image.save(self._scaled, format="JPEG", quality=SNAPSHOT_JPEG_QUALITY)
+        return self._scaled.getvalue()
@@ -0,0 +1,431 @@
+from __future__ import annotations
+from bisect import bisect
+from collections import Counter, deque
+import dataclasses
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from queue import Empty
+import signal
+import sys
+from threading import Thread
+import time
+import typing as t
+
+from .const import *
+
+
+__all__ = ["HashRing", "Supervisor", "validate_cameras"]
+
+
+logger = logging.getLogger(__name__)
+
+# Workers are spawned rather than forked, as the supervisor may already have running threads
+_context = multiprocessing.get_context("spawn")
+
+
+# Keyword arguments for `Amcrest2MQTT`, plus an optional `serial_no` used for sharding
+CameraDef = t.Dict[str, t.Any]
+
+
+def camera_key(camera: CameraDef) -> str:
+    return str(camera.get("serial_no") or camera["amcrest_host"])
+
+
+def validate_cameras(
+    cameras: t.List[CameraDef], fields: t.Optional[t.AbstractSet[str]] = None
+) -> t.List[CameraDef]:
+    """
+    Check camera definitions (with defaults applied) before handing them to worker processes,
+    where they would only fail once running, returning them with their values converted to the
+    types of settings, as for a config file (see `Amcrest2MQTT.convert_setting()`)
+
+    Raises `ValueError` listing every problem; `fields` are the keys a camera may set, besides
+    `serial_no`
+    """
+    from .amcrest2mqtt import Amcrest2MQTT
+
+    settings = {field.name: field for field in dataclasses.fields(Amcrest2MQTT)}
+    errors = []
+    keys = set()
+    converted = []
+    for index, camera in enumerate(cameras):
+        if not isinstance(camera, dict):
+            errors.append(f"camera {index} isn't an object")
+            continue
+        camera = dict(camera)
+        for name, value in camera.items():
+            try:
+                if name == "serial_no":
+                    camera[name] = str(value) if value is not None else None
+                elif name in settings:
+                    camera[name] = Amcrest2MQTT.convert_setting(settings[name], value)
+            except (TypeError, ValueError) as error:
+                errors.append(f'camera {index} setting "{name}" {error}')
+        converted.append(camera)
+
+        required = ["mqtt_username"]
+        if not camera.get("replay"):
+            required += ["amcrest_host", "amcrest_password"]
+        missing = [name for name in required if camera.get(name) is None]
+        if missing:
+            errors.append(f"camera {index} is missing {', '.join(missing)}")
+            continue
+        if fields is not None:
+            unknown = sorted(set(camera) - set(fields) - {"serial_no"})
+            if unknown:
+                errors.append(f"camera {index} has unknown settings {', '.join(unknown)}")
+        key = camera_key(camera)
+        if key in keys:
+            errors.append(f'camera {index} duplicates "{key}"')
+        keys.add(key)
+    if errors:
+        raise ValueError("Invalid cameras: " + "; ".join(errors))
+    return converted
+
+
+class HashRing:
+    """
+    Consistent hashing of camera keys onto worker indexes
+
+    Removing a worker only moves the cameras that were assigned to it
+    """
+
+    def __init__(self, nodes: t.Iterable[int], replicas: int = SUPERVISOR_HASH_REPLICAS):
+        self.nodes = sorted(set(nodes))
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [hash_ for hash_, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def get(self, key: str) -> int:
+        index = bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class WorkerState:
+    def __init__(self, index: int, cameras: t.List[CameraDef]):
+        self.index = index
+        self.cameras = cameras
+        self.process: t.Optional[multiprocessing.Process] = None
+        self.inbox: t.Optional[multiprocessing.Queue] = None
+        self.crashes: t.Deque[float] = deque()
+        self.restart_at: t.Optional[float] = None
+        # Set while out of the hash ring after crashing too often
+        self.rejoin_at: t.Optional[float] = None
+        self.metrics: t.Dict[str, t.Dict[str, int]] = {}
+
+
+class Supervisor:
+    """
+    Runs several cameras across worker processes, each running one `Amcrest2MQTT` per camera
+
+    Cameras are assigned to workers by consistent hashing on their serial number (or host). A
+    failing camera is restarted within its worker; a crashed worker is restarted with exponential
+    backoff, leaving the other workers untouched. Once a worker crashes more than
+    `SUPERVISOR_MAX_RESTARTS` times within `SUPERVISOR_RESTART_WINDOW` seconds while the others
+    keep running, its cameras are rebalanced onto the remaining workers until it rejoins
+    `SUPERVISOR_REJOIN_DELAY` seconds later. Failures hitting every worker (e.g. the broker going
+    away) only restart workers.
+    """
+
+    def __init__(
+        self,
+        cameras: t.Iterable[CameraDef],
+        workers: int,
+        defaults: t.Dict[str, t.Any],
+        fields: t.Optional[t.AbstractSet[str]] = None,
+    ):
+        self.cameras = validate_cameras(
+            [{**defaults, **camera} if isinstance(camera, dict) else camera for camera in cameras],
+            fields,
+        )
+        self.ring = HashRing(range(workers or os.cpu_count() or 1))
+        self.workers: t.Dict[int, WorkerState] = {
+            index: WorkerState(index, []) for index in self.ring.nodes
+        }
+        for camera in self.cameras:
+            self.workers[self.ring.get(camera_key(camera))].cameras.append(camera)
+        # Out of the hash ring until they rejoin, by index
+        self.removed: t.Dict[int, WorkerState] = {}
+        self.metrics_queue: multiprocessing.Queue = _context.Queue()
+        self._stopping = False
+
+    @classmethod
+    def from_file(
+        cls,
+        path: str,
+        workers: int,
+        defaults: t.Dict[str, t.Any],
+        fields: t.Optional[t.AbstractSet[str]] = None,
+    ) -> "Supervisor":
+        with open(path, encoding="utf-8") as file:
+            cameras = json.load(file)
+        if not isinstance(cameras, list):
+            raise ValueError("Invalid cameras: expected a list")
+        return cls(cameras, workers, defaults, fields)
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+        logger.info(
+            f"Supervising {len(self.cameras)} camera(s) across {len(self.workers)} worker(s)"
+        )
+        for worker in self.workers.values():
+            self.start_worker(worker)
+
+        next_report = time.monotonic() + SUPERVISOR_METRICS_INTERVAL
+        while not self._stopping:
+            self.drain_metrics(timeout=1)
+            now = time.monotonic()
+            for worker in list(self.workers.values()):
+                self.check_worker(worker, now)
+            for worker in list(self.removed.values()):
+                if now >= worker.rejoin_at:
+                    self.rejoin(worker, now)
+            if now >= next_report:
+                self.report_metrics()
+                next_report = now + SUPERVISOR_METRICS_INTERVAL
+
+    def start_worker(self, worker: WorkerState):
+        worker.restart_at = None
+        if not worker.cameras:
+            logger.info(f"Worker {worker.index} has no cameras assigned")
+            return
+        worker.inbox = _context.Queue()
+        worker.process = _context.Process(
+            target=run_worker,
+            args=(
+                worker.index,
+                worker.cameras,
+                worker.inbox,
+                self.metrics_queue,
+                logging.getLogger().level,
+            ),
+            name=f"{APP_NAME}-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        logger.info(
+            f"Started worker {worker.index} (pid {worker.process.pid}) for "
+            + ", ".join(camera_key(camera) for camera in worker.cameras)
+        )
+
+    def check_worker(self, worker: WorkerState, now: float):
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                self.start_worker(worker)
+            return
+
+        if worker.process is None or worker.process.is_alive():
+            return
+
+        logger.error(f"Worker {worker.index} exited with code {worker.process.exitcode}")
+        worker.process = None
+        worker.metrics = {}
+        worker.crashes.append(now)
+        while worker.crashes and now - worker.crashes[0] > SUPERVISOR_RESTART_WINDOW:
+            worker.crashes.popleft()
+
+        if len(worker.crashes) > SUPERVISOR_MAX_RESTARTS and len(self.workers) > 1:
+            if not self.others_failing(worker, now):
+                self.rebalance_without(worker, now)
+                return
+            logger.warning(f"Worker {worker.index} keeps crashing, as do others; not rebalancing")
+
+        backoff = min(2 ** (len(worker.crashes) - 1), SUPERVISOR_MAX_BACKOFF)
+        logger.info(f"Restarting worker {worker.index} in {backoff}s")
+        worker.restart_at = now + backoff
+
+    def others_failing(self, worker: WorkerState, now: float) -> bool:
+        """Whether any other worker crashed recently, i.e. the failure isn't the worker's own"""
+        return any(
+            other.crashes and now - other.crashes[-1] <= SUPERVISOR_RESTART_WINDOW
+            for other in self.workers.values()
+            if other is not worker
+        )
+
+    def rebalance_without(self, failed: WorkerState, now: float):
+        logger.error(
+            f"Worker {failed.index} keeps crashing, rebalancing its cameras for "
+            f"{SUPERVISOR_REJOIN_DELAY}s"
+        )
+        del self.workers[failed.index]
+        self.removed[failed.index] = failed
+        failed.rejoin_at = now + SUPERVISOR_REJOIN_DELAY
+        self.ring = HashRing(self.workers)
+
+        for camera in failed.cameras:
+            worker = self.workers[self.ring.get(camera_key(camera))]
+            worker.cameras.append(camera)
+            if worker.inbox is not None and worker.process is not None:
+                worker.inbox.put(("start", camera))
+            elif worker.restart_at is None:
+                self.start_worker(worker)
+        failed.cameras = []
+
+    def rejoin(self, worker: WorkerState, now: float):
+        """Return a removed worker to the hash ring, taking back the cameras that hash to it"""
+        logger.info(f"Worker {worker.index} rejoining")
+        del self.removed[worker.index]
+        worker.rejoin_at = None
+        worker.crashes.clear()
+        self.workers[worker.index] = worker
+        self.ring = HashRing(self.workers)
+
+        for other in self.workers.values():
+            for camera in list(other.cameras):
+                if other is worker or self.ring.get(camera_key(camera)) != worker.index:
+                    continue
+                other.cameras.remove(camera)
+                worker.cameras.append(camera)
+                if other.inbox is not None and other.process is not None:
+                    other.inbox.put(("stop", camera_key(camera)))
+        # Gives the other workers time to stop the cameras before this one starts them
+        worker.restart_at = now + SUPERVISOR_HANDOVER_DELAY
+
+    def drain_metrics(self, timeout: float):
+        try:
+            index, metrics = self.metrics_queue.get(timeout=timeout)
+            while True:
+                if index in self.workers:
+                    self.workers[index].metrics = metrics
+                index, metrics = self.metrics_queue.get_nowait()
+        except Empty:
+            pass
+
+    def report_metrics(self):
+        totals: t.Counter[str] = Counter()
+        for worker in self.workers.values():
+            for camera_metrics in worker.metrics.values():
+                totals.update(camera_metrics)
+        alive = sum(
+            1 for worker in self.workers.values() if worker.process and worker.process.is_alive()
+        )
+        logger.info(
+            f"Workers alive: {alive}/{len(self.workers)}, "
+            + ", ".join(f"{key}: {value}" for key, value in sorted(totals.items()))
+        )
+
+    def signal_handler(self, sig, frame):
+        if self._stopping:
+            sys.exit(1)
+        self._stopping = True
+        logger.info("Stopping workers...")
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.terminate()
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.join(timeout=10)
+        sys.exit(0)
+
+
+def run_worker(
+    index: int,
+    cameras: t.List[CameraDef],
+    inbox: multiprocessing.Queue,
+    metrics_queue: multiprocessing.Queue,
+    log_level: int,
+):
+    """
+    Entrypoint of a worker process; runs each camera in its own thread
+
+    A camera that stops (e.g. losing its connection to the camera or the broker) is restarted
+    on its own with exponential backoff, leaving the worker's other cameras running. The
+    supervisor sends `("start", camera)` and `("stop", key)` messages to `inbox` as cameras move
+    between workers.
+    """
+    from .amcrest2mqtt import Amcrest2MQTT
+
+    # SIGINT goes to the whole process group; let the supervisor decide when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    logging.basicConfig(
+        level=log_level,
+        datefmt="%d/%m/%Y %H:%M:%S",
+        format=f"%(asctime)s [%(levelname)s] [worker {index}] [%(threadName)s] %(message)s",
+    )
+    logging.captureWarnings(True)
+    logger = logging.getLogger(__name__)
+
+    # By camera key
+    definitions: t.Dict[str, CameraDef] = {}
+    apps: t.Dict[str, Amcrest2MQTT] = {}
+    threads: t.Dict[str, Thread] = {}
+    crashes: t.Dict[str, t.Deque[float]] = {}
+    restart_at: t.Dict[str, float] = {}
+
+    def failed(key: str, now: float):
+        history = crashes.setdefault(key, deque())
+        history.append(now)
+        while now - history[0] > SUPERVISOR_RESTART_WINDOW:
+            history.popleft()
+        backoff = min(2 ** (len(history) - 1), SUPERVISOR_MAX_BACKOFF)
+        logger.error(f"Camera {key} stopped, restarting it in {backoff}s")
+        restart_at[key] = now + backoff
+
+    def start(key: str):
+        kwargs = {name: value for name, value in definitions[key].items() if name != "serial_no"}
+        try:
+            app = Amcrest2MQTT(**kwargs)
+        except (TypeError, ValueError, OSError) as exc:
+            logger.error(f"Invalid settings for camera {key}: {exc}")
+            failed(key, time.monotonic())
+            return
+        app.exit_process = False
+        apps[key] = app
+        threads[key] = Thread(target=app.run, name=key, daemon=True)
+        threads[key].start()
+
+    def stop(key: str):
+        definitions.pop(key, None)
+        restart_at.pop(key, None)
+        crashes.pop(key, None)
+        threads.pop(key, None)
+        app = apps.pop(key, None)
+        if app is not None:
+            logger.info(f"Handing camera {key} over to another worker")
+            app.stop(publish_offline=False)
+
+    for camera in cameras:
+        definitions[camera_key(camera)] = camera
+        start(camera_key(camera))
+
+    next_report = 0.0
+    while True:
+        try:
+            action, arg = inbox.get(timeout=1)
+        except Empty:
+            pass
+        else:
+            if action == "start" and camera_key(arg) not in definitions:
+                definitions[camera_key(arg)] = arg
+                start(camera_key(arg))
+            elif action == "stop":
+                stop(arg)
+
+        now = time.monotonic()
+        for key, app in list(apps.items()):
+            if app.stopped.is_set() or not threads[key].is_alive():
+                # The thread may still be blocked reading events; it exits on the next one
+                app.stop()
+                del apps[key], threads[key]
+                failed(key, now)
+        for key, at in list(restart_at.items()):
+            if now >= at:
+                del restart_at[key]
+                start(key)
+
+        if now >= next_report:
+            metrics_queue.put((index, {key: dict(app.metrics) for key, app in apps.items()}))
+            next_report = now + SUPERVISOR_METRICS_INTERVAL
@@ -1,12 +1,14 @@
 from datetime import timedelta
+import re
+import sys
 import typing as t
-import platform
-import subprocess
 
-from slugify import slugify as _slugify
 
+SYS_WINDOWS = sys.platform == "win32"
 
-SYS_WINDOWS = platform.system().lower() == "windows"
+# Matches what python-slugify does for ASCII text without HTML entities
+_SLUG_NUMBER_COMMA = re.compile(r"(?<=\d),(?=\d)")
+_SLUG_SEPARATORS = re.compile(r"[^a-z0-9]+")
 
 _T = t.TypeVar("_T", int, float)
 
@@ -23,12 +25,22 @@ def ping(host: str, timeout: t.Union[float, int, timedelta] = None) -> bool:
         command += ["-w" if SYS_WINDOWS else "-W", str(timeout)]
     command += [host]
 
+    import subprocess  # Only needed when pinging, which not every process does
+
     p = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
     return p.returncode == 0
 
 
 def slugify(text: str) -> str:
+    # Names are nearly always plain ASCII, so python-slugify (and its transliteration tables)
+    # is only loaded for anything else
+    if text.isascii() and "&" not in text:
+        text = _SLUG_NUMBER_COMMA.sub("", text.lower())
+        return _SLUG_SEPARATORS.sub("_", text).strip("_")
+
+    from slugify import slugify as _slugify
+
     return _slugify(text, separator="_")
 
 
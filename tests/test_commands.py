@@ -0,0 +1,114 @@
+from collections import Counter
+import time
+
+import pytest
+
+from amcrest2mqtt import commands
+from amcrest2mqtt.camera import AmcrestError
+from amcrest2mqtt.commands import CommandPipeline
+from amcrest2mqtt.device import Device
+from amcrest2mqtt.registry import EntityRegistry
+
+DEVICE = Device("Front Door", "AD410", "SN410", "1.0")
+LIGHT_MODE = "Lighting_V2[0][0][1].Mode"
+LIGHT_STATE = "Lighting_V2[0][0][1].State"
+RING_VOLUME = "VideoTalkPhoneGeneral.RingVolume"
+
+
+class FakeCamera:
+    def __init__(self, config):
+        self.config = config
+        self.applies = True
+        self.reads = 0
+
+    def set_config(self, values):
+        if self.applies:
+            self.config.update({key: str(value) for key, value in values.items()})
+        return True
+
+    def get_configs(self, names):
+        self.reads += 1
+        return {name: self.config[name] for name in names if name in self.config}
+
+
+@pytest.fixture(autouse=True)
+def fast_readback(monkeypatch):
+    monkeypatch.setattr(commands, "TIME_COMMAND_READBACK", 0.01)
+
+
+@pytest.fixture
+def setup():
+    entities = EntityRegistry.load().compile(DEVICE, set())
+    published = []
+    for entity in entities:
+        entity.register_publish_callback(
+            lambda payload, topic=None, entity=entity: published.append(
+                (entity.name_slug, topic or "", payload)
+            )
+        )
+    camera = FakeCamera({LIGHT_MODE: "Off", LIGHT_STATE: "Off", RING_VOLUME: "50"})
+    metrics = Counter()
+    pipeline = CommandPipeline(camera, entities, metrics)
+    return pipeline, entities, camera, metrics, published
+
+
+def settle(pipeline):
+    deadline = time.monotonic() + 2
+    while (pipeline._pending or pipeline._readback_timer) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_optimistic_state_is_confirmed_by_read_back(setup):
+    pipeline, entities, camera, metrics, published = setup
+    light = entities.get("flashlight")
+    pipeline.submit(light, {LIGHT_MODE: "ForceOn", LIGHT_STATE: "On"}, {"": "on", "effect": "None"})
+    assert ("flashlight", "", "on") in published
+    settle(pipeline)
+    assert camera.reads == 1
+    assert metrics["commands"] == 1 and metrics["command_rollbacks"] == 0
+    assert published[-1][2] != "off"
+
+
+def test_rejected_command_rolls_back(setup):
+    pipeline, entities, camera, metrics, published = setup
+    light = entities.get("flashlight")
+    light.publish("off")
+    camera.applies = False
+    pipeline.submit(light, {LIGHT_MODE: "ForceOn", LIGHT_STATE: "On"}, {"": "on", "effect": "None"})
+    settle(pipeline)
+    assert metrics["command_rollbacks"] == 1
+    assert ("flashlight", "", "off") in published[-2:]
+
+
+def test_state_command_rolls_back_to_camera_value(setup):
+    pipeline, entities, camera, metrics, published = setup
+    volume = entities.get("siren_volume")
+    camera.applies = False
+    pipeline.submit(volume, {RING_VOLUME: 80}, {})
+    assert published[0] == ("siren_volume", "", 80)
+    settle(pipeline)
+    assert published[-1] == ("siren_volume", "", 50)
+
+
+def test_event_confirms_without_read_back(setup):
+    pipeline, entities, camera, metrics, published = setup
+    light = entities.get("flashlight")
+    pipeline.submit(light, {LIGHT_MODE: "ForceOn", LIGHT_STATE: "On"}, {"": "on", "effect": "None"})
+    pipeline.confirm("flashlight", {"": "on"})
+    settle(pipeline)
+    assert camera.reads == 0
+    assert metrics["command_rollbacks"] == 0
+
+
+def test_failed_set_rolls_back(setup):
+    pipeline, entities, camera, metrics, published = setup
+    volume = entities.get("siren_volume")
+    volume.publish(50)
+
+    def fail(values):
+        raise AmcrestError("timeout")
+
+    camera.set_config = fail
+    pipeline.submit(volume, {RING_VOLUME: 80}, {})
+    assert published[-1] == ("siren_volume", "", 50)
+    assert metrics["command_rollbacks"] == 1
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from amcrest2mqtt.latency import LatencyHistogram, LatencyTracker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().percentiles(50, 99) == (None, None)
+
+
+def test_percentiles_within_a_bucket(clock):
+    histogram = LatencyHistogram()
+    for latency in range(1, 101):
+        histogram.record(float(latency))
+    p50, p95, p99 = histogram.percentiles(50, 95, 99)
+    # Upper bounds of buckets growing by 25%
+    assert 50 <= p50 <= 50 * 1.25
+    assert 95 <= p95 <= 95 * 1.25
+    assert 99 <= p99 <= 99 * 1.25
+    assert histogram.count() == 100
+
+
+def test_latencies_beyond_the_last_bucket_are_clamped(clock):
+    histogram = LatencyHistogram(buckets=4)
+    histogram.record(10_000.0)
+    assert histogram.percentiles(100) == (round(histogram.bucket_bound(3), 1),)
+
+
+def test_window_rolls_over(clock):
+    histogram = LatencyHistogram(slots=2, slot_duration=60)
+    histogram.record(5.0)
+    clock[0] += 60
+    histogram.record(500.0)
+    assert histogram.count() == 2
+    clock[0] += 60
+    assert histogram.count() == 1
+    (p50,) = histogram.percentiles(50)
+    assert p50 >= 500
+    clock[0] += 60
+    assert histogram.percentiles(50) == (None,)
+
+
+def test_tracker_summarizes_per_entity(clock):
+    tracker = LatencyTracker()
+    received_at = clock[0]
+    clock[0] += 0.02
+    tracker.record("motion", received_at)
+    tracker.record("doorbell", received_at)
+    tracker.record("doorbell", received_at)
+    summary = tracker.summary()
+    assert list(summary) == ["doorbell", "motion"]
+    assert summary["doorbell"]["count"] == 2
+    assert 20 <= summary["motion"]["p50"] <= 25
+    assert tracker.overall.count() == 3
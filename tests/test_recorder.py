@@ -0,0 +1,48 @@
+import pytest
+
+from amcrest2mqtt.camera import AmcrestError
+from amcrest2mqtt.device import Device
+from amcrest2mqtt.recorder import EventRecorder, ReplayCamera
+
+DEVICE = Device("Front Door", "AD410", "SN410", "1.0")
+EVENTS = [
+    ("VideoMotion", {"Code": "VideoMotion", "action": "Start", "index": "0"}),
+    ("_DoTalkAction_", {"Code": "_DoTalkAction_", "data": {"Action": "Invite"}}),
+]
+
+
+def record(path, events):
+    recorder = EventRecorder(str(path), DEVICE)
+    for code, payload in events:
+        recorder.record(code, payload)
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    record(path, EVENTS).close()
+    camera = ReplayCamera(str(path), speed=0)
+    assert camera.get_device() == DEVICE
+    assert [(code, payload) for code, payload in camera.events()] == EVENTS
+
+
+def test_sessions_are_appended(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    record(path, EVENTS[:1]).close()
+    record(path, EVENTS[1:]).close()
+    assert list(ReplayCamera(str(path), speed=0).events()) == EVENTS
+
+
+def test_unterminated_session_is_readable(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    recorder = record(path, EVENTS)  # Not closed, as if the app crashed
+    record(path, EVENTS[:1]).close()
+    assert list(ReplayCamera(str(path), speed=0).events()) == EVENTS + EVENTS[:1]
+    recorder.close()
+
+
+def test_replay_camera_has_no_camera_commands(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    record(path, []).close()
+    with pytest.raises(AmcrestError):
+        ReplayCamera(str(path)).get_config_all()
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from amcrest2mqtt.const import FEATURE_HEALTH
+from amcrest2mqtt.device import Device
+from amcrest2mqtt.registry import EntityDefinition, EntityRegistry
+
+AD110 = Device("Front Door", "AD110", "SN110", "1.0")
+AD410 = Device("Front Door", "AD410", "SN410", "1.0")
+
+
+def test_builtin_registry_loads():
+    registry = EntityRegistry.load()
+    assert {definition.name for definition in registry.definitions} >= {"Doorbell", "Motion"}
+
+
+def test_compile_filters_by_model():
+    registry = EntityRegistry.load()
+    ad110 = registry.compile(AD110, set())
+    ad410 = registry.compile(AD410, set())
+    assert "doorbell" in ad110 and "doorbell" in ad410
+    assert "human" not in ad110 and "human" in ad410
+    assert "flashlight" not in ad110 and "flashlight" in ad410
+
+
+def test_compile_filters_by_feature():
+    registry = EntityRegistry.load()
+    assert "uptime" not in registry.compile(AD410, set())
+    assert "uptime" in registry.compile(AD410, {FEATURE_HEALTH})
+
+
+def test_compile_indexes_commands_and_states():
+    table = EntityRegistry.load().compile(AD410, set())
+    siren = table.get("siren_volume")
+    entity, definition, command = table.commands[siren.command_topics["command"]]
+    assert entity is siren and command.type == "int"
+    assert (siren, definition.state) in table.states["VideoTalkPhoneGeneral.RingVolume"]
+    assert command.to_value("150") == 100  # Clamped to the command's range
+
+
+@pytest.mark.parametrize(
+    "obj, message",
+    [
+        ({"name": "X", "component": "switch", "model": ["AD410"]}, "Unknown keys"),
+        ({"name": "X", "component": "switch", "commands": [1]}, "Expected an object"),
+        ({"name": "X", "component": "switch", "state": {"config_key": "A", "type": "x"}}, "type"),
+        (
+            {"name": "X", "component": "switch", "commands": {"command": {"topic": "~/set"}}},
+            "Either",
+        ),
+        (
+            {
+                "name": "X",
+                "component": "number",
+                "commands": {"command": {"topic": "~/set", "type": "int"}},
+            },
+            "requires the entity to have a",
+        ),
+    ],
+)
+def test_invalid_definitions(obj, message):
+    with pytest.raises(ValueError, match=message):
+        EntityDefinition.from_dict(obj)
+
+
+def test_load_rejects_non_list(tmp_path):
+    path = tmp_path / "entities.json"
+    path.write_text(json.dumps({"name": "X"}))
+    with pytest.raises(ValueError, match="Expected a list"):
+        EntityRegistry.load(str(path))
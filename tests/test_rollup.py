@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from amcrest2mqtt.const import ROLLUP_MAX_CODES, ROLLUP_OTHER_CODE
+from amcrest2mqtt.rollup import EventAggregator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_empty_rollup_has_consistent_keys(clock):
+    aggregator = EventAggregator(["minute"], tallies=["doorbell_presses"], states=["motion"])
+    rollup = aggregator.rollup("minute")
+    assert rollup["events"] == 0
+    assert rollup["codes"] == {}
+    assert rollup["doorbell_presses"] == 0
+    assert rollup["motion_seconds"] == 0.0
+
+
+def test_counts_and_tallies_per_window(clock):
+    aggregator = EventAggregator(["minute", "hour"], tallies=["doorbell_presses"])
+    aggregator.count("VideoMotion")
+    aggregator.count("VideoMotion")
+    aggregator.tally("doorbell_presses")
+    minute = aggregator.rollup("minute")
+    assert minute["events"] == 2
+    assert minute["codes"] == {"VideoMotion": 2}
+    assert minute["doorbell_presses"] == 1
+
+    aggregator.count("CrossLineDetection")
+    assert aggregator.rollup("minute")["codes"] == {"CrossLineDetection": 1}
+    assert aggregator.rollup("hour")["events"] == 3
+
+
+def test_codes_beyond_the_limit_count_as_other(clock):
+    aggregator = EventAggregator(["minute"])
+    for index in range(ROLLUP_MAX_CODES + 3):
+        aggregator.count(f"Code{index}")
+    aggregator.count("Code0")
+    codes = aggregator.rollup("minute")["codes"]
+    assert len(codes) == ROLLUP_MAX_CODES + 1
+    assert codes[ROLLUP_OTHER_CODE] == 3
+    assert codes["Code0"] == 2
+
+
+def test_active_states_are_split_across_windows(clock):
+    aggregator = EventAggregator(["minute"], states=["motion"])
+    aggregator.set_active("motion", True)
+    clock[0] += 10
+    aggregator.set_active("motion", False)
+    aggregator.set_active("motion", True)
+    clock[0] += 5
+    assert aggregator.rollup("minute")["motion_seconds"] == 15.0
+    clock[0] += 20
+    aggregator.set_active("motion", False)
+    assert aggregator.rollup("minute")["motion_seconds"] == 20.0
+
+
+def test_until_next():
+    assert 0 < EventAggregator.until_next(60) <= 60
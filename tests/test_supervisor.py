@@ -0,0 +1,52 @@
+import pytest
+
+from amcrest2mqtt.supervisor import HashRing, validate_cameras
+
+CAMERA = {"amcrest_host": "192.168.0.10", "amcrest_password": "password", "mqtt_username": "u"}
+
+
+def test_placement_is_stable():
+    keys = [f"SN{index}" for index in range(100)]
+    assert [HashRing(range(4)).get(key) for key in keys] == [
+        HashRing(range(4)).get(key) for key in keys
+    ]
+
+
+def test_placement_spreads_keys():
+    ring = HashRing(range(4))
+    placed = {ring.get(f"SN{index}") for index in range(100)}
+    assert placed == {0, 1, 2, 3}
+
+
+def test_removing_a_node_only_moves_its_keys():
+    keys = [f"SN{index}" for index in range(200)]
+    before = HashRing(range(4))
+    after = HashRing([0, 1, 3])
+    for key in keys:
+        if before.get(key) != 2:
+            assert after.get(key) == before.get(key)
+        else:
+            assert after.get(key) in (0, 1, 3)
+
+
+def test_validate_converts_settings():
+    camera = {**CAMERA, "amcrest_port": "8080", "snapshots": "false", "serial_no": 123}
+    (converted,) = validate_cameras([camera])
+    assert converted["amcrest_port"] == 8080
+    assert converted["snapshots"] is False
+    assert converted["serial_no"] == "123"
+
+
+@pytest.mark.parametrize(
+    "cameras, message",
+    [
+        ([{"amcrest_host": "h", "mqtt_username": "u"}], "missing amcrest_password"),
+        ([CAMERA, CAMERA], "duplicates"),
+        ([{**CAMERA, "amcrest_port": "x"}], '"amcrest_port" must be a number'),
+        ([{**CAMERA, "bogus": 1}], "unknown settings bogus"),
+        (["camera"], "isn't an object"),
+    ],
+)
+def test_validate_rejects(cameras, message):
+    with pytest.raises(ValueError, match=message):
+        validate_cameras(cameras, fields=set(CAMERA) | {"amcrest_port"})